@@ -0,0 +1,206 @@
+import os
+import json
+import asyncio
+import hashlib
+import sqlite3
+from fastapi.concurrency import run_in_threadpool
+from dotenv import load_dotenv
+
+import analysis_cache
+import groq_scheduler
+import translation
+
+# Load environment variables
+load_dotenv()
+
+# Groq completion settings
+ANALYSIS_MODEL = "llama-3.3-70b-versatile"
+ANALYSIS_TEMPERATURE = 0.1
+ANALYSIS_MAX_COMPLETION_TOKENS = 8000
+
+# Transcripts estimated above this many tokens are analysed segment by segment (map-reduce)
+LONG_TRANSCRIPT_TOKENS = int(os.getenv("LONG_TRANSCRIPT_TOKENS", "6000"))
+SEGMENT_TOKENS = int(os.getenv("ANALYSIS_SEGMENT_TOKENS", "3000"))
+SEGMENT_CONCURRENCY = int(os.getenv("ANALYSIS_SEGMENT_CONCURRENCY", "4"))
+CHARS_PER_TOKEN = 4  # rough average for English text
+
+# Output structure consumed by generate_report_v2
+ANALYSIS_JSON_STRUCTURE = """{
+        "summary": "Detailed executive summary of the conversation.",
+        "sentiment": "Positive/Negative/Neutral",
+        "overall_score": 85,
+        "performance_metrics": {"closing_probability": 75, "objection_handling": 60, "empathy_score": 80, "product_knowledge": 90, "conversation_control": 50},
+        "products_analysis": [
+            {"product": "Maida", "mentions": 5, "priority": "High"},
+            {"product": "Sooji", "mentions": 2, "priority": "Low"}
+        ],
+        "product_insights": {"total_unique": 2, "most_emphasized": "Maida", "recommendation": "Push Sooji more."},
+        "promise_analysis": {"good_promises_count": 1, "bad_promises_count": 0, "quality_score": "90/100", "problematic_statements": []},
+        "improvement_roadmap": [
+            {"category": "Closing Skills", "observation": "Did not ask for the order.", "recommendation": "Use a direct close next time.", "priority": "HIGH"},
+            {"category": "Product Knowledge", "observation": "Stumbled on price.", "recommendation": "Memorize price list.", "priority": "MEDIUM"}
+        ],
+        "sentiment_details": {"positive_percent": 60, "negative_percent": 10, "neutral_percent": 30, "enthusiasm_score": "7/10", "professional_tone": "8/10"},
+        "top_recommendations": ["Ask for order earlier", "Mention discount scheme"],
+        "product_acceptance_data": {"total_offered": 5, "total_accepted": 3, "acceptance_rate": 60},
+        "next_actions": {"rep_improvements": ["Be more confident"], "predicted_next_orders": ["50kg Maida"], "follow_up_date": "Tuesday"}
+    }"""
+
+ANALYSIS_PROMPT = """
+    Analyze the sales call transcript (Tamil translated to English) and return a JSON object matching this EXACT structure.
+    
+    
+    CRITICAL DEFINITIONS FOR PROMISE CLASSIFICATION:
+    - "GOOD PROMISE": A realistic commitment (e.g., "I will check stock," "I will visit Tuesday"). Trust-building.
+    - "BAD PROMISE": False guarantees, over-committing on things outside control (e.g., "Price will NEVER change," "You will definitely get 100% refund," "No other shop has this"). Trust-damaging.
+    
+    CRITICAL RULES:
+    1. "improvement_roadmap": Must include at least 2-3 specific actionable items. NOT empty.
+    2. "product_insights": Must analyze which products were discussed.
+    3. "products_analysis": List ALL products mentioned, even generic ones.
+    
+    JSON Structure:
+    {structure}
+    TRANSCRIPT: {transcript}
+    """
+
+SEGMENT_PROMPT = """
+    You are analysing PART {part} of {parts} of a sales call transcript (Tamil translated to English).
+    Extract compact notes for this part only and return a JSON object with this structure:
+    {{
+        "summary": "2-3 sentence summary of this part.",
+        "products": [{{"product": "Maida", "mentions": 3, "offered": true, "accepted": false}}],
+        "good_promises": ["Realistic commitments made by the rep (quote briefly)"],
+        "bad_promises": ["False guarantees / over-commitments (quote briefly)"],
+        "objections": ["Customer objections and how they were handled"],
+        "observations": [{{"category": "Closing Skills", "observation": "...", "priority": "HIGH"}}],
+        "sentiment": {{"positive_percent": 60, "negative_percent": 10, "neutral_percent": 30}},
+        "next_steps": ["Follow-ups, predicted orders or dates mentioned"]
+    }}
+    A "GOOD PROMISE" is a realistic commitment; a "BAD PROMISE" is a false guarantee or an over-commitment outside the rep's control.
+    TRANSCRIPT PART: {transcript}
+    """
+
+REDUCE_PROMPT = """
+    Below are JSON notes for consecutive parts of ONE long sales call (Tamil translated to English).
+    Merge them into a single analysis of the whole call and return a JSON object matching this EXACT structure.
+    Sum product mentions across parts, count promises across parts, and weight sentiment by the whole call.
+
+    CRITICAL RULES:
+    1. "improvement_roadmap": Must include at least 2-3 specific actionable items. NOT empty.
+    2. "product_insights": Must analyze which products were discussed.
+    3. "products_analysis": List ALL products mentioned, even generic ones.
+
+    JSON Structure:
+    {structure}
+    PART NOTES: {notes}
+    """
+
+
+# Bump to force re-analysis when something outside the prompt text changes the output.
+# Edits to the prompts or segmenting settings change PROMPT_VERSION automatically.
+PROMPT_TEMPLATE_VERSION = "1"
+PROMPT_VERSION = PROMPT_TEMPLATE_VERSION + "-" + hashlib.sha256(
+    "\n".join([
+        ANALYSIS_PROMPT, SEGMENT_PROMPT, REDUCE_PROMPT, ANALYSIS_JSON_STRUCTURE,
+        str(LONG_TRANSCRIPT_TOKENS), str(SEGMENT_TOKENS),
+    ]).encode("utf-8")
+).hexdigest()[:12]
+
+
+def cache_key(translated_text):
+    """Analysis cache key: transcript, model, prompt version and temperature."""
+    payload = json.dumps([translated_text, ANALYSIS_MODEL, PROMPT_VERSION, ANALYSIS_TEMPERATURE])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def estimate_tokens(text):
+    """Cheap token estimate used to pick the analysis mode."""
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def split_segments(text, segment_tokens=SEGMENT_TOKENS):
+    """Splits a transcript into sentence-aligned segments of roughly segment_tokens each."""
+    max_chars = segment_tokens * CHARS_PER_TOKEN
+    sentences = translation.split_sentences(text, max_chars=max_chars)
+    return [" ".join(batch) for batch in translation.make_batches(sentences, max_chars=max_chars)]
+
+
+async def _complete_json(client, prompt, max_completion_tokens=ANALYSIS_MAX_COMPLETION_TOKENS):
+    # All Groq calls go through the shared scheduler so concurrent jobs stay within rate limits
+    completion = await groq_scheduler.get_scheduler().run(
+        lambda: client.chat.completions.create(
+            model=ANALYSIS_MODEL,
+            messages=[{"role": "user", "content": prompt}],
+            temperature=ANALYSIS_TEMPERATURE,
+            response_format={"type": "json_object"},
+            max_completion_tokens=max_completion_tokens
+        ),
+        estimate_tokens(prompt)
+    )
+    return json.loads(completion.choices[0].message.content)
+
+
+async def analyze_transcript(client, translated_text, progress_callback=None):
+    """
+    Runs the Groq sales analysis and returns the parsed JSON used by generate_report_v2.
+    Transcripts above LONG_TRANSCRIPT_TOKENS are split into segments that are analysed
+    concurrently with a compact schema, then merged by a single reduce call.
+    Results are cached per (transcript, model, prompt version, temperature); the cache is
+    best-effort, so a locked or broken cache database never fails the analysis.
+    """
+    key = cache_key(translated_text)
+    try:
+        cached = await run_in_threadpool(analysis_cache.get, key)
+    except sqlite3.Error as e:
+        print(f"[WARNING] Analysis cache lookup failed: {e}")
+        cached = None
+    if cached is not None:
+        print("Analysis cache hit.")
+        if progress_callback:
+            progress_callback("AI Analysis found in cache.")
+        return cached
+
+    result = await _analyze_uncached(client, translated_text, progress_callback)
+    try:
+        await run_in_threadpool(analysis_cache.put, key, PROMPT_VERSION, result)
+    except sqlite3.Error as e:
+        print(f"[WARNING] Analysis cache write failed: {e}")
+    return result
+
+
+async def _analyze_uncached(client, translated_text, progress_callback=None):
+    if estimate_tokens(translated_text) <= LONG_TRANSCRIPT_TOKENS:
+        prompt = ANALYSIS_PROMPT.format(structure=ANALYSIS_JSON_STRUCTURE, transcript=translated_text)
+        return await _complete_json(client, prompt)
+
+    segments = split_segments(translated_text)
+    print(f"Long transcript (~{estimate_tokens(translated_text)} tokens): analysing {len(segments)} segments...")
+    if progress_callback:
+        progress_callback(f"AI Analysis: {len(segments)} segments...")
+
+    limiter = asyncio.Semaphore(SEGMENT_CONCURRENCY)
+    done = 0
+
+    async def analyze_segment(idx, segment):
+        nonlocal done
+        prompt = SEGMENT_PROMPT.format(part=idx + 1, parts=len(segments), transcript=segment)
+        async with limiter:
+            notes = await _complete_json(client, prompt, max_completion_tokens=2000)
+        done += 1
+        if progress_callback:
+            progress_callback(f"AI Analysis: segment {done}/{len(segments)} done...")
+        return notes
+
+    notes = await asyncio.gather(*(analyze_segment(idx, segment) for idx, segment in enumerate(segments)))
+
+    if progress_callback:
+        progress_callback("AI Analysis: merging segments...")
+    prompt = REDUCE_PROMPT.format(
+        structure=ANALYSIS_JSON_STRUCTURE,
+        notes=json.dumps([{"part": idx + 1, **n} for idx, n in enumerate(notes)], ensure_ascii=False)
+    )
+    return await _complete_json(client, prompt)
+
+
+analysis_cache.init_db(PROMPT_VERSION)
@@ -0,0 +1,113 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+
+# Persistent cache of parsed LLM analysis results
+CACHE_ENABLED = os.getenv("ANALYSIS_CACHE", "1") == "1"
+CACHE_DB = os.getenv("ANALYSIS_CACHE_DB", os.path.join("cache", "analysis.db"))
+CACHE_MAX_ENTRIES = int(os.getenv("ANALYSIS_CACHE_MAX_ENTRIES", "2000"))
+
+_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidated": 0}
+
+
+def _connect():
+    return sqlite3.connect(CACHE_DB)
+
+
+def init_db(prompt_version=None):
+    """
+    Creates the cache table. If prompt_version is given, entries produced by any
+    other prompt version are dropped, since they can never be hit again.
+    """
+    os.makedirs(os.path.dirname(CACHE_DB) or ".", exist_ok=True)
+    conn = _connect()
+    c = conn.cursor()
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS analysis_cache (
+            key TEXT PRIMARY KEY,
+            prompt_version TEXT,
+            result TEXT,
+            created_at REAL,
+            last_used REAL
+        )
+    ''')
+    if prompt_version is not None:
+        c.execute("DELETE FROM analysis_cache WHERE prompt_version != ?", (prompt_version,))
+        if c.rowcount:
+            print(f"Analysis cache: dropped {c.rowcount} entries from older prompt versions")
+            _stats["invalidated"] += c.rowcount
+    conn.commit()
+    conn.close()
+
+
+def get(key):
+    """Returns the cached analysis dict for key, or None."""
+    if not CACHE_ENABLED:
+        return None
+    conn = _connect()
+    c = conn.cursor()
+    c.execute("SELECT result FROM analysis_cache WHERE key=?", (key,))
+    row = c.fetchone()
+    if row:
+        c.execute("UPDATE analysis_cache SET last_used=? WHERE key=?", (time.time(), key))
+        conn.commit()
+    conn.close()
+
+    with _lock:
+        _stats["hits" if row else "misses"] += 1
+    return json.loads(row[0]) if row else None
+
+
+def put(key, prompt_version, result):
+    """Stores an analysis result and evicts the least recently used entries above CACHE_MAX_ENTRIES."""
+    if not CACHE_ENABLED:
+        return
+    now = time.time()
+    conn = _connect()
+    c = conn.cursor()
+    c.execute(
+        "INSERT OR REPLACE INTO analysis_cache (key, prompt_version, result, created_at, last_used) VALUES (?, ?, ?, ?, ?)",
+        (key, prompt_version, json.dumps(result, ensure_ascii=False), now, now)
+    )
+    c.execute('''
+        DELETE FROM analysis_cache WHERE key IN (
+            SELECT key FROM analysis_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?
+        )
+    ''', (CACHE_MAX_ENTRIES,))
+    evicted = c.rowcount
+    conn.commit()
+    conn.close()
+    if evicted > 0:
+        with _lock:
+            _stats["evictions"] += evicted
+
+
+def clear():
+    """Invalidates every cached analysis. Returns the number of entries removed."""
+    conn = _connect()
+    c = conn.cursor()
+    c.execute("DELETE FROM analysis_cache")
+    removed = c.rowcount
+    conn.commit()
+    conn.close()
+    with _lock:
+        _stats["invalidated"] += removed
+    return removed
+
+
+def stats():
+    conn = _connect()
+    c = conn.cursor()
+    c.execute("SELECT COUNT(*) FROM analysis_cache")
+    entries = c.fetchone()[0]
+    conn.close()
+    with _lock:
+        result = dict(_stats)
+    lookups = result["hits"] + result["misses"]
+    result["hit_rate"] = round(result["hits"] / lookups, 3) if lookups else 0.0
+    result["entries"] = entries
+    result["max_entries"] = CACHE_MAX_ENTRIES
+    return result
@@ -0,0 +1,502 @@
+import io
+import os
+import subprocess
+import wave
+import numpy as np
+
+try:
+    import soundfile  # optional: in-process FLAC encoding
+except ImportError:
+    soundfile = None
+
+# Normalized format expected by the transcription pipeline (16kHz, mono, 16-bit PCM)
+TARGET_SAMPLE_RATE = 16000
+
+# WAV files up to this size are downmixed/resampled in-process instead of via FFmpeg
+INPROCESS_MAX_BYTES = int(float(os.getenv("INPROCESS_CONVERT_MAX_MB", "200")) * 1024 * 1024)
+
+# Silence detection settings
+SILENCE_WINDOW_MS = int(os.getenv("SILENCE_WINDOW_MS", "30"))
+SILENCE_RMS_FLOOR = float(os.getenv("SILENCE_RMS_FLOOR", "50"))  # ~ -56 dBFS on 16-bit PCM
+SILENCE_SKIP_SECONDS = float(os.getenv("SILENCE_SKIP_SECONDS", "2.0"))  # silences longer than this are dropped
+CHUNK_MAX_SECONDS = 50  # Sync recognize limit is ~60s
+CHUNK_MIN_SECONDS = 20
+CHUNK_JOIN_PAD_SECONDS = 0.3  # silence inserted between packed speech spans
+# Bump whenever the way chunk boundaries are found changes (e.g. the silence threshold formula)
+CHUNKING_VERSION = 2
+
+
+def pcm_to_array(frames, channels):
+    """Returns 16-bit PCM bytes as an int16 array shaped (n_frames, channels)."""
+    samples = np.frombuffer(frames, dtype=np.int16)
+    n_frames = len(samples) // channels
+    return samples[:n_frames * channels].reshape(n_frames, channels)
+
+
+def _runs(mask):
+    """Returns (starts, ends) of consecutive True runs in a boolean array."""
+    padded = np.concatenate(([0], mask.astype(np.int8), [0]))
+    edges = np.diff(padded)
+    return np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+
+
+def window_rms(samples, sample_rate, window_ms=SILENCE_WINDOW_MS):
+    """
+    Computes the RMS energy of fixed-size windows over a (n_frames, channels) array.
+
+    Returns:
+        tuple: (rms array per window, window size in frames)
+    """
+    win = max(1, int(sample_rate * window_ms / 1000))
+    n_win = len(samples) // win
+    if n_win == 0:
+        return np.zeros(0, dtype=np.float32), win
+    mono = samples[:n_win * win].astype(np.float32).mean(axis=1)
+    rms = np.sqrt(np.mean(mono.reshape(n_win, win) ** 2, axis=1))
+    return rms, win
+
+
+class SilenceLevels:
+    """
+    Running noise-floor and speech-level estimate used to derive the silence threshold.
+
+    Levels are measured per CHUNK_MAX_SECONDS block of windows (quietest 10% for the noise floor,
+    loudest 10% for speech) and kept across blocks, so a block that is all dead air is judged
+    against the speech heard elsewhere in the recording rather than against itself.
+    """
+
+    def __init__(self, window_ms=SILENCE_WINDOW_MS, block_s=CHUNK_MAX_SECONDS):
+        self.block_windows = max(1, int(block_s * 1000 / window_ms))
+        self.noise = None
+        self.loud = None
+
+    def add(self, rms):
+        for start in range(0, len(rms), self.block_windows):
+            block = rms[start:start + self.block_windows]
+            noise = float(np.percentile(block, 10))
+            loud = float(np.percentile(block, 90))
+            self.noise = noise if self.noise is None else min(self.noise, noise)
+            self.loud = loud if self.loud is None else max(self.loud, loud)
+
+    def threshold(self):
+        """
+        Twice the noise floor, but never above a quarter of the speech level so that quiet
+        recordings are not mistaken for silence; never below SILENCE_RMS_FLOOR, so dead air counts as silence.
+        """
+        if self.loud is None:
+            return SILENCE_RMS_FLOOR
+        return max(SILENCE_RMS_FLOOR, min(self.noise * 2.0, self.loud * 0.25))
+
+
+def silence_threshold(rms):
+    """Derives the RMS level below which a window counts as silence (see SilenceLevels)."""
+    levels = SilenceLevels()
+    levels.add(rms)
+    return levels.threshold()
+
+
+def plan_speech_spans(samples, sample_rate, max_chunk_s=CHUNK_MAX_SECONDS,
+                      min_chunk_s=CHUNK_MIN_SECONDS, skip_silence_s=SILENCE_SKIP_SECONDS,
+                      threshold=None):
+    """
+    Finds speech spans in PCM audio, cutting at pauses instead of fixed offsets.
+
+    Silences longer than skip_silence_s are removed entirely. Speech regions
+    longer than max_chunk_s are split at the last pause after min_chunk_s,
+    or hard-cut at max_chunk_s when no pause exists.
+
+    Args:
+        samples: int16 array shaped (n_frames, channels)
+        sample_rate: Sample rate of the audio
+        threshold: Optional RMS threshold; derived from the noise floor if omitted
+
+    Returns:
+        list: (start_frame, end_frame) tuples, each no longer than max_chunk_s
+    """
+    total = len(samples)
+    rms, win = window_rms(samples, sample_rate)
+    if len(rms) == 0:
+        return [(0, total)] if total else []
+
+    if threshold is None:
+        threshold = silence_threshold(rms)
+    silent = rms < threshold
+
+    # Speech regions are whatever remains after removing long silent runs
+    skip_windows = max(1, int(skip_silence_s * sample_rate / win))
+    sil_starts, sil_ends = _runs(silent)
+    long_silence = (sil_ends - sil_starts) >= skip_windows
+    keep = np.ones(len(rms), dtype=bool)
+    for start, end in zip(sil_starts[long_silence], sil_ends[long_silence]):
+        keep[start:end] = False
+    reg_starts, reg_ends = _runs(keep)
+
+    max_w = max(1, int(max_chunk_s * sample_rate / win))
+    min_w = min(max_w, int(min_chunk_s * sample_rate / win))
+    silent_idx = np.flatnonzero(silent)
+
+    spans = []
+    for reg_start, reg_end in zip(reg_starts, reg_ends):
+        pos = int(reg_start)
+        while reg_end - pos > max_w:
+            lo = np.searchsorted(silent_idx, pos + min_w)
+            hi = np.searchsorted(silent_idx, pos + max_w)
+            cut = int(silent_idx[hi - 1]) if hi > lo else pos + max_w
+            spans.append((pos * win, cut * win))
+            pos = cut
+        # The final window of the file absorbs the trailing partial window
+        end_frame = total if reg_end == len(rms) else int(reg_end) * win
+        spans.append((pos * win, end_frame))
+    return spans
+
+
+def split_on_silence(frames, sample_rate, channels, max_chunk_s=CHUNK_MAX_SECONDS, threshold=None,
+                     fallback=True):
+    """
+    Splits 16-bit PCM into recognizer-sized chunks at pauses, dropping long silences.
+
+    Short neighbouring speech spans are packed into a single chunk (separated by a
+    brief pad of silence) so that dead air does not multiply the number of requests.
+
+    Args:
+        threshold: Optional RMS silence threshold; derived from this audio if omitted
+        fallback: Send fixed slices when no speech is found at all (whole recordings only)
+
+    Returns:
+        list: PCM byte chunks, each no longer than max_chunk_s
+    """
+    samples = pcm_to_array(frames, channels)
+    spans = plan_speech_spans(samples, sample_rate, max_chunk_s=max_chunk_s, threshold=threshold)
+    if not spans and len(samples) and fallback:
+        # Nothing recognised as speech: send the audio in fixed slices rather than nothing at all
+        step = int(max_chunk_s * sample_rate)
+        spans = [(start, min(start + step, len(samples))) for start in range(0, len(samples), step)]
+        print("Silence split: no speech detected, falling back to fixed chunks")
+
+    pad = np.zeros((int(CHUNK_JOIN_PAD_SECONDS * sample_rate), channels), dtype=np.int16)
+    max_frames = int(max_chunk_s * sample_rate)
+
+    chunks = []
+    current = []
+    current_len = 0
+    for start, end in spans:
+        length = end - start
+        if current and current_len + len(pad) + length > max_frames:
+            chunks.append(np.concatenate(current).tobytes())
+            current, current_len = [], 0
+        if current:
+            current.append(pad)
+            current_len += len(pad)
+        current.append(samples[start:end])
+        current_len += length
+    if current:
+        chunks.append(np.concatenate(current).tobytes())
+
+    kept = sum(end - start for start, end in spans)
+    skipped = (len(samples) - kept) / float(sample_rate)
+    print(f"Silence split: {len(spans)} speech spans -> {len(chunks)} chunks, {skipped:.1f}s of silence skipped")
+    return chunks
+
+
+def chunking_signature(silence_split=True):
+    """
+    Describes everything that decides chunk boundaries. Checkpointed chunk indexes are only
+    valid for the same signature, so it is part of the transcription checkpoint key.
+    """
+    if not silence_split:
+        return f"fixed:{CHUNK_MAX_SECONDS}"
+    return (f"silence:v{CHUNKING_VERSION}:{SILENCE_WINDOW_MS}:{SILENCE_RMS_FLOOR}:{SILENCE_SKIP_SECONDS}:"
+            f"{CHUNK_MIN_SECONDS}:{CHUNK_MAX_SECONDS}:{CHUNK_JOIN_PAD_SECONDS}")
+
+
+def ffmpeg_pcm_command(input_path, output_path, raw=False):
+    """
+    Builds the FFmpeg command that normalizes audio to 16kHz mono 16-bit PCM.
+    With raw=True headerless s16le is written (e.g. to "pipe:1" for streaming).
+    """
+    # -vn (no video), -acodec pcm_s16le (16-bit PCM), -ar 16000 (16kHz), -ac 1 (mono), -y (overwrite)
+    command = [
+        "ffmpeg", "-i", input_path,
+        "-vn",
+        "-acodec", "pcm_s16le",
+        "-ar", str(TARGET_SAMPLE_RATE),
+        "-ac", "1",
+    ]
+    if raw:
+        command += ["-f", "s16le"]
+    command += ["-y", output_path]
+    return command
+
+
+def find_cut(samples, sample_rate, min_chunk_s=CHUNK_MIN_SECONDS, max_chunk_s=CHUNK_MAX_SECONDS, threshold=None):
+    """Returns the frame index of the last pause between min_chunk_s and max_chunk_s (or max_chunk_s)."""
+    max_frames = min(len(samples), int(max_chunk_s * sample_rate))
+    rms, win = window_rms(samples[:max_frames], sample_rate)
+    if len(rms) == 0:
+        return max_frames
+    if threshold is None:
+        threshold = silence_threshold(rms)
+    min_w = int(min_chunk_s * sample_rate / win)
+    silent_idx = np.flatnonzero(rms[min_w:] < threshold)
+    if len(silent_idx) == 0:
+        return max_frames
+    return (int(silent_idx[-1]) + min_w) * win
+
+
+def iter_pcm_chunks(blocks, sample_rate, channels=1, max_chunk_s=CHUNK_MAX_SECONDS):
+    """
+    Streaming counterpart of split_on_silence.
+
+    Consumes an iterator of 16-bit PCM byte blocks and yields recognizer-sized chunks
+    as soon as enough audio has arrived, cutting at pauses and dropping long silences.
+    Noise and speech levels are carried across segments (SilenceLevels), so a segment
+    of pure dead air is recognised as silence.
+    """
+    frame_bytes = 2 * channels
+    max_bytes = int(max_chunk_s * sample_rate) * frame_bytes
+    buffer = bytearray()
+    levels = SilenceLevels()
+    measured = 0  # bytes at the start of buffer whose levels are already in `levels`
+
+    def measure(samples):
+        nonlocal measured
+        new = samples[measured // frame_bytes:]
+        levels.add(window_rms(new, sample_rate)[0])
+        measured += len(new) * frame_bytes
+
+    for block in blocks:
+        buffer.extend(block)
+        while len(buffer) >= max_bytes:
+            samples = pcm_to_array(bytes(buffer[:max_bytes]), channels)
+            measure(samples)
+            threshold = levels.threshold()
+            cut = find_cut(samples, sample_rate, max_chunk_s=max_chunk_s, threshold=threshold) * frame_bytes
+            segment = bytes(buffer[:cut])
+            del buffer[:cut]
+            measured -= cut
+            for chunk in split_on_silence(segment, sample_rate, channels, max_chunk_s=max_chunk_s,
+                                          threshold=threshold, fallback=False):
+                yield chunk
+
+    usable = len(buffer) - len(buffer) % frame_bytes
+    if usable:
+        samples = pcm_to_array(bytes(buffer[:usable]), channels)
+        measure(samples)
+        for chunk in split_on_silence(bytes(buffer[:usable]), sample_rate, channels, max_chunk_s=max_chunk_s,
+                                      threshold=levels.threshold(), fallback=levels.loud is None):
+            yield chunk
+
+
+def probe_wav(file_path):
+    """Reads the WAV header. Returns its format as a dict, or None if not a readable PCM WAV."""
+    try:
+        with wave.open(file_path, "rb") as wf:
+            return {
+                "sample_rate": wf.getframerate(),
+                "channels": wf.getnchannels(),
+                "sampwidth": wf.getsampwidth(),
+                "n_frames": wf.getnframes(),
+            }
+    except (wave.Error, EOFError, OSError):
+        return None
+
+
+# MPEG audio bitrates (kbps) by bitrate index for Layer III: MPEG-1, then MPEG-2/2.5
+_MP3_BITRATES = {
+    3: [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    2: [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+
+
+def estimate_duration(head, file_size):
+    """
+    Estimates the duration of an audio file from its first bytes and total size, without
+    reading the rest of it. Understands PCM WAV headers and (CBR-accurate) MP3 frame headers.
+
+    Args:
+        head: The first few KB of the file
+        file_size: Total size of the file in bytes
+
+    Returns:
+        float: Duration in seconds, or None if the format is not recognised
+    """
+    if head[:4] == b"RIFF" and head[8:12] == b"WAVE":
+        pos, byte_rate = 12, None
+        while pos + 8 <= len(head):
+            chunk_id = head[pos:pos + 4]
+            chunk_size = int.from_bytes(head[pos + 4:pos + 8], "little")
+            if chunk_id == b"fmt " and pos + 20 <= len(head):
+                byte_rate = int.from_bytes(head[pos + 16:pos + 20], "little")
+            elif chunk_id == b"data":
+                # Streamed WAVs often carry a bogus data size, so use what is actually on disk
+                return (file_size - pos - 8) / byte_rate if byte_rate else None
+            pos += 8 + chunk_size + (chunk_size & 1)
+        return None
+
+    offset = 0
+    if head[:3] == b"ID3" and len(head) >= 10:
+        # ID3v2 tag size is a 28-bit "syncsafe" integer
+        offset = 10 + sum((head[6 + i] & 0x7F) << (7 * (3 - i)) for i in range(4))
+    limit = min(len(head) - 3, offset + 4096)
+    for pos in range(offset, max(offset, limit)):
+        if head[pos] != 0xFF or head[pos + 1] & 0xE0 != 0xE0:
+            continue
+        version = (head[pos + 1] >> 3) & 0x03  # 3 = MPEG-1, 2 = MPEG-2, 0 = MPEG-2.5
+        layer = (head[pos + 1] >> 1) & 0x03  # 1 = Layer III
+        bitrate_index = head[pos + 2] >> 4
+        if layer != 1 or version == 1 or bitrate_index in (0, 15):
+            continue
+        kbps = _MP3_BITRATES[3 if version == 3 else 2][bitrate_index]
+        return (file_size - pos) * 8 / (kbps * 1000)
+    return None
+
+
+def wav_fast_path(file_path):
+    """
+    Decides whether a file can skip FFmpeg.
+
+    Returns:
+        "passthrough" if it is already 16kHz mono 16-bit PCM,
+        "inprocess" if only a downmix and/or simple resample is needed,
+        None if FFmpeg is required.
+    """
+    info = probe_wav(file_path)
+    if info is None or info["sampwidth"] != 2 or info["n_frames"] == 0:
+        return None
+    rate, channels = info["sample_rate"], info["channels"]
+    if rate == TARGET_SAMPLE_RATE and channels == 1:
+        return "passthrough"
+    if os.path.getsize(file_path) > INPROCESS_MAX_BYTES:
+        return None
+    # Upsampling (e.g. 8kHz telephony) or integer-factor decimation (32/48kHz)
+    if rate <= TARGET_SAMPLE_RATE or rate % TARGET_SAMPLE_RATE == 0:
+        return "inprocess"
+    return None
+
+
+def _interpolate(buffer, buffer_start, out_start, out_end, rate, target_rate):
+    """
+    Linear interpolation of output samples [out_start, out_end) from a float32 buffer whose
+    first sample is input sample buffer_start. Input positions are split into an integer index
+    and a float32 weight, so 8kHz -> 16kHz is an exact 2x and nothing is promoted to float64.
+    """
+    scaled = np.arange(out_start, out_end, dtype=np.int64) * rate
+    index = scaled // target_rate - buffer_start
+    weight = ((scaled % target_rate) / target_rate).astype(np.float32)
+    # Past the last input sample the signal is held, as np.interp does
+    index = np.minimum(index, len(buffer) - 1)
+    following = np.minimum(index + 1, len(buffer) - 1)
+    left = buffer[index]
+    return left + weight * (buffer[following] - left)
+
+
+def resample(mono, rate, target_rate=TARGET_SAMPLE_RATE):
+    """Resamples a float mono signal: linear interpolation up, box-filtered decimation down."""
+    if rate == target_rate:
+        return mono
+    if rate < target_rate:
+        n_out = int(round(len(mono) * target_rate / rate))
+        return _interpolate(mono.astype(np.float32, copy=False), 0, 0, n_out, rate, target_rate)
+    factor = rate // target_rate
+    usable = len(mono) - len(mono) % factor
+    # Averaging each group of samples low-passes before decimating
+    return mono[:usable].reshape(-1, factor).mean(axis=1)
+
+
+# Input frames read per block by normalize_wav; bounds its memory regardless of file size
+NORMALIZE_BLOCK_FRAMES = 1 << 18
+
+
+def normalize_wav(input_path, output_path):
+    """
+    In-process equivalent of the FFmpeg conversion for PCM WAV input that
+    wav_fast_path() reports as "inprocess": downmixes to mono and resamples to 16kHz.
+    The file is processed in blocks of NORMALIZE_BLOCK_FRAMES, in float32.
+    """
+    with wave.open(input_path, "rb") as wf, wave.open(output_path, "wb") as out:
+        rate = wf.getframerate()
+        channels = wf.getnchannels()
+        n_frames = wf.getnframes()
+        out.setnchannels(1)
+        out.setsampwidth(2)
+        out.setframerate(TARGET_SAMPLE_RATE)
+
+        factor = rate // TARGET_SAMPLE_RATE if rate > TARGET_SAMPLE_RATE else 1
+        # Whole decimation groups per block, so no group straddles two blocks
+        block_frames = max(factor, NORMALIZE_BLOCK_FRAMES - NORMALIZE_BLOCK_FRAMES % factor)
+        n_out = int(round(n_frames * TARGET_SAMPLE_RATE / rate))
+        carry = np.zeros(0, dtype=np.float32)  # last input sample, needed to interpolate across blocks
+        consumed = 0
+        written = 0
+        while True:
+            frames = wf.readframes(block_frames)
+            if not frames:
+                break
+            mono = pcm_to_array(frames, channels).astype(np.float32).mean(axis=1)
+            if rate >= TARGET_SAMPLE_RATE:
+                mono = resample(mono, rate)
+            else:
+                buffer = np.concatenate((carry, mono))
+                buffer_start = consumed - len(carry)
+                consumed += len(mono)
+                if consumed >= n_frames:
+                    end = n_out
+                else:
+                    # Only outputs whose right-hand neighbour has been read already
+                    end = min(n_out, -(-(consumed - 1) * TARGET_SAMPLE_RATE // rate))
+                mono = _interpolate(buffer, buffer_start, written, end, rate, TARGET_SAMPLE_RATE)
+                written = end
+                carry = buffer[-1:]
+            out.writeframes(np.clip(np.round(mono), -32768, 32767).astype(np.int16).tobytes())
+    return output_path
+
+
+# Upload encodings supported by encode_chunk, as named in RecognitionConfig.AudioEncoding
+UPLOAD_ENCODINGS = ("LINEAR16", "FLAC", "OGG_OPUS")
+TELEPHONY_SAMPLE_RATE = 8000
+OPUS_BITRATE = os.getenv("OPUS_BITRATE", "24k")
+
+
+def _ffmpeg_encode(frames, sample_rate, channels, codec_args):
+    command = [
+        "ffmpeg", "-f", "s16le", "-ar", str(sample_rate), "-ac", str(channels), "-i", "pipe:0",
+        *codec_args, "pipe:1",
+    ]
+    result = subprocess.run(command, input=frames, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True)
+    return result.stdout
+
+
+def encode_chunk(frames, sample_rate, channels, encoding="LINEAR16", telephony=False):
+    """
+    Prepares a 16-bit PCM chunk for upload to the Speech API.
+
+    Args:
+        frames: Raw LINEAR16 frames
+        encoding: One of UPLOAD_ENCODINGS. FLAC is lossless at roughly half the size,
+            OGG_OPUS is lossy at a small fraction of it.
+        telephony: Downmix and downsample to 8kHz first (narrowband phone audio loses nothing)
+
+    Returns:
+        tuple: (content bytes, encoding name, sample rate, channels). Falls back to
+        LINEAR16 if the requested encoder is not available.
+    """
+    if telephony and sample_rate > TELEPHONY_SAMPLE_RATE and sample_rate % TELEPHONY_SAMPLE_RATE == 0:
+        mono = pcm_to_array(frames, channels).astype(np.float32).mean(axis=1)
+        mono = resample(mono, sample_rate, TELEPHONY_SAMPLE_RATE)
+        frames = np.clip(np.round(mono), -32768, 32767).astype(np.int16).tobytes()
+        sample_rate, channels = TELEPHONY_SAMPLE_RATE, 1
+
+    try:
+        if encoding == "FLAC":
+            if soundfile is not None:
+                buffer = io.BytesIO()
+                soundfile.write(buffer, pcm_to_array(frames, channels), sample_rate, format="FLAC", subtype="PCM_16")
+                return buffer.getvalue(), encoding, sample_rate, channels
+            return _ffmpeg_encode(frames, sample_rate, channels, ["-c:a", "flac", "-f", "flac"]), encoding, sample_rate, channels
+        if encoding == "OGG_OPUS":
+            codec_args = ["-c:a", "libopus", "-b:a", OPUS_BITRATE, "-f", "ogg"]
+            return _ffmpeg_encode(frames, sample_rate, channels, codec_args), encoding, sample_rate, channels
+    except (OSError, subprocess.CalledProcessError) as e:
+        print(f"{encoding} encoding failed ({e}), sending LINEAR16 instead")
+
+    return frames, "LINEAR16", sample_rate, channels
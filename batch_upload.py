@@ -0,0 +1,130 @@
+import os
+import asyncio
+import argparse
+import mimetypes
+from pathlib import Path
+import httpx
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Analysis server that receives the batch
+ANALYSIS_SERVER_URL = os.getenv("ANALYSIS_SERVER_URL", "http://localhost:8000")
+
+AUDIO_EXTENSIONS = {".wav", ".mp3", ".m4a", ".aac", ".ogg", ".opus", ".flac", ".amr", ".webm", ".wma", ".zip"}
+
+
+def find_recordings(directory, recursive=False):
+    """Lists the audio files (and ZIP archives) in a directory, sorted by name."""
+    path = Path(directory)
+    candidates = path.rglob("*") if recursive else path.glob("*")
+    return sorted(p for p in candidates if p.is_file() and p.suffix.lower() in AUDIO_EXTENSIONS)
+
+
+async def submit_directory(directory, server_url=ANALYSIS_SERVER_URL, group_size=20, priority=0, force=False,
+                           recursive=False):
+    """
+    Sends every recording in a directory to /api/batch as one batch.
+    Files go up in groups of group_size per request (streamed from disk), all under the same batch id.
+
+    Returns:
+        dict: {"success": bool, "batch_id": str, "jobs": [...], "error": str (optional)}
+    """
+    files = find_recordings(directory, recursive)
+    if not files:
+        return {"success": False, "batch_id": None, "jobs": [], "error": f"No recordings found in {directory}"}
+
+    batch_id = None
+    jobs = []
+    async with httpx.AsyncClient(base_url=server_url, timeout=None) as client:
+        for start in range(0, len(files), group_size):
+            group = files[start:start + group_size]
+            handles = [open(p, "rb") for p in group]
+            try:
+                form = {"priority": str(priority)}
+                if batch_id:
+                    form["batch_id"] = batch_id
+                response = await client.post(
+                    "/api/batch",
+                    params={"force": "true"} if force else None,
+                    data=form,
+                    files=[("files", (p.name, f, mimetypes.guess_type(p.name)[0] or "application/octet-stream"))
+                           for p, f in zip(group, handles)]
+                )
+            finally:
+                for f in handles:
+                    f.close()
+
+            if response.status_code != 200:
+                error_msg = f"API returned status {response.status_code}: {response.text[:200]}"
+                print(f"❌ Batch upload failed: {error_msg}")
+                return {"success": False, "batch_id": batch_id, "jobs": jobs, "error": error_msg}
+            result = response.json()
+            batch_id = result["batch_id"]
+            jobs.extend(result["jobs"])
+            print(f"✅ Sent {start + len(group)}/{len(files)} files ({len(jobs)} recordings queued)")
+
+    return {"success": True, "batch_id": batch_id, "jobs": jobs}
+
+
+async def wait_for_batch(batch_id, server_url=ANALYSIS_SERVER_URL, poll_seconds=10):
+    """Polls /api/batch/{batch_id} until every recording has finished; returns the final status."""
+    async with httpx.AsyncClient(base_url=server_url, timeout=60.0) as client:
+        last = None
+        while True:
+            response = await client.get(f"/api/batch/{batch_id}")
+            response.raise_for_status()
+            status = response.json()
+            summary = ", ".join(f"{name}: {count}" for name, count in sorted(status["counts"].items()))
+            if summary != last:
+                print(f"Batch {batch_id[:8]}: {status['finished']}/{status['total']} finished ({summary})")
+                last = summary
+            if status["status"] == "completed":
+                return status
+            await asyncio.sleep(poll_seconds)
+
+
+async def analyse_directory(directory, server_url=ANALYSIS_SERVER_URL, group_size=20, priority=0, force=False,
+                            recursive=False, wait=True):
+    """CLI entry point: submit a directory as a batch and optionally follow it to the end."""
+    print("\n" + "="*60)
+    print("BATCH ANALYSIS UPLOAD")
+    print("="*60)
+    print(f"Server: {server_url}")
+    print(f"Directory: {directory}")
+    print("="*60)
+
+    result = await submit_directory(directory, server_url, group_size, priority, force, recursive)
+    if not result["success"]:
+        print(f"❌ {result['error']}")
+        return result
+    print(f"Batch ID: {result['batch_id']}")
+    if not wait:
+        return result
+
+    status = await wait_for_batch(result["batch_id"], server_url)
+    for job in status["jobs"]:
+        if job["status"] == "completed":
+            print(f"✅ {job['filename']}: {server_url}{job['report_url']}")
+        else:
+            print(f"❌ {job['filename']}: {job['status']} - {job['message']}")
+
+    print(f"\n{'='*60}")
+    print("BATCH COMPLETE")
+    print(f"{'='*60}\n")
+    return {**result, "status": status}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Submit a directory of call recordings for analysis as one batch")
+    parser.add_argument("directory", help="Directory with audio files and/or ZIP archives")
+    parser.add_argument("--server", default=ANALYSIS_SERVER_URL, help="Analysis server base URL")
+    parser.add_argument("--group-size", type=int, default=20, help="Files per upload request")
+    parser.add_argument("--priority", type=int, default=0, help="Job priority, -10..10 (higher runs sooner)")
+    parser.add_argument("--force", action="store_true", help="Re-analyse recordings that were analysed before")
+    parser.add_argument("--recursive", action="store_true", help="Include subdirectories")
+    parser.add_argument("--no-wait", action="store_true", help="Return once the batch is queued")
+    args = parser.parse_args()
+    asyncio.run(analyse_directory(args.directory, args.server, args.group_size, args.priority, args.force,
+                                  args.recursive, not args.no_wait))
@@ -0,0 +1,67 @@
+import os
+import sys
+import time
+import wave
+import argparse
+import tempfile
+import numpy as np
+
+import speech_backends
+import transcript_cache
+import transcription
+
+
+def make_test_wav(path, duration_s, sample_rate=16000, seed=0):
+    """Writes a speech-like WAV: bursts of tone separated by short and long pauses."""
+    rng = np.random.default_rng(seed)
+    parts = []
+    total = 0.0
+    while total < duration_s:
+        burst = rng.uniform(3, 15)
+        t = np.arange(int(burst * sample_rate))
+        parts.append((np.sin(t * rng.uniform(0.05, 0.2)) * 6000).astype(np.int16))
+        pause = rng.choice([0.4, 0.8, 3.0])
+        parts.append(rng.normal(0, 30, int(pause * sample_rate)).astype(np.int16))
+        total += burst + pause
+    with wave.open(path, "wb") as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(2)
+        wf.setframerate(sample_rate)
+        wf.writeframes(np.concatenate(parts).tobytes())
+
+
+def run(duration_s, concurrency_levels, latency, error_rate):
+    # Benchmarks must measure the pipeline, not the cache
+    transcript_cache.CACHE_ENABLED = False
+    workdir = tempfile.mkdtemp(prefix="stt_bench_")
+    transcript_cache.CHECKPOINT_DIR = os.path.join(workdir, "checkpoints")
+    wav_path = os.path.join(workdir, "bench.wav")
+    make_test_wav(wav_path, duration_s)
+
+    print(f"Audio: {duration_s:.0f}s, stub latency {latency}s, error rate {error_rate:.0%}")
+    print(f"{'workers':>8} {'seconds':>9} {'requests':>9} {'audio x realtime':>17}")
+    results = {}
+    for workers in concurrency_levels:
+        backend = speech_backends.StubSpeechBackend(latency=latency, error_rate=error_rate, seed=0)
+        start = time.perf_counter()
+        transcription.transcribe_audio_direct(wav_path, max_workers=workers, backend=backend)
+        elapsed = time.perf_counter() - start
+        results[workers] = elapsed
+        print(f"{workers:>8} {elapsed:>9.2f} {backend.calls:>9} {duration_s / elapsed:>17.1f}")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline transcription throughput benchmark (stub backend)")
+    parser.add_argument("--duration", type=float, default=1800, help="Audio length in seconds")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--latency", type=float, default=0.2, help="Stub latency per request (s)")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--max-seconds", type=float, default=None,
+                        help="Exit non-zero if the highest worker count takes longer than this (for CI)")
+    args = parser.parse_args()
+
+    timings = run(args.duration, args.workers, args.latency, args.error_rate)
+    if args.max_seconds is not None and timings[max(args.workers)] > args.max_seconds:
+        print(f"Throughput regression: {timings[max(args.workers)]:.2f}s > {args.max_seconds:.2f}s")
+        sys.exit(1)
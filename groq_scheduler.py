@@ -0,0 +1,190 @@
+import os
+import re
+import time
+import asyncio
+import random
+import groq
+from fastapi.concurrency import run_in_threadpool
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Provider budgets for the Groq account (requests and tokens per minute)
+GROQ_RPM = float(os.getenv("GROQ_RPM", "30"))
+GROQ_TPM = float(os.getenv("GROQ_TPM", "12000"))
+# Each uvicorn worker process runs its own scheduler, so the account budget is split between them
+WEB_WORKERS = max(1, int(os.getenv("WEB_WORKERS", "1")))
+# Completion tokens reserved per call on top of the prompt estimate; reconciled with actual usage
+GROQ_EXPECTED_COMPLETION_TOKENS = int(os.getenv("GROQ_EXPECTED_COMPLETION_TOKENS", "1500"))
+GROQ_MAX_RETRIES = int(os.getenv("GROQ_MAX_RETRIES", "5"))
+# Backoff cap for transient failures (connection errors, timeouts, 408/409/5xx), which only delay the failing call
+GROQ_RETRY_MAX_DELAY = float(os.getenv("GROQ_RETRY_MAX_DELAY", "30"))
+
+
+def _parse_seconds(value):
+    """Parses retry-after style values: "7", "7.5", "7.66s", "1m30s", "250ms"."""
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    total = 0.0
+    matched = False
+    for amount, unit in re.findall(r"([\d.]+)(ms|h|m|s)", value):
+        matched = True
+        total += float(amount) * {"ms": 0.001, "s": 1, "m": 60, "h": 3600}[unit]
+    return total if matched else None
+
+
+def retry_after_seconds(error):
+    """Extracts the wait requested by a Groq 429 response, if any."""
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    headers = response.headers
+    for header in ("retry-after", "x-ratelimit-reset-tokens", "x-ratelimit-reset-requests"):
+        seconds = _parse_seconds(headers.get(header))
+        if seconds is not None:
+            return seconds
+    return None
+
+
+def is_transient(error):
+    """True for errors the Groq SDK itself would retry: connection problems, timeouts, 408, 409 and 5xx."""
+    if isinstance(error, groq.APIConnectionError):
+        return True
+    if isinstance(error, groq.APIStatusError):
+        return error.status_code in (408, 409) or error.status_code >= 500
+    return False
+
+
+class GroqScheduler:
+    """
+    Process-wide token-bucket limiter for Groq calls.
+
+    Two buckets refill continuously: one for requests per minute, one for tokens per minute.
+    Callers wait in FIFO order (asyncio.Lock wakes waiters first-come, first-served) until both
+    buckets can cover the call, so bursts of jobs queue instead of tripping rate limits.
+    A 429 pauses every caller for the retry-after period before the call is retried;
+    transient errors back off the failing call only.
+    """
+
+    def __init__(self, rpm=GROQ_RPM / WEB_WORKERS, tpm=GROQ_TPM / WEB_WORKERS):
+        self.rpm = rpm
+        self.tpm = tpm
+        self._requests = rpm
+        self._tokens = tpm
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = None
+        self.waiting = 0
+        self.stats = {"calls": 0, "rate_limited": 0, "transient_errors": 0, "wait_seconds": 0.0, "tokens_used": 0}
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self._updated
+        self._updated = now
+        self._requests = min(self.rpm, self._requests + elapsed * self.rpm / 60.0)
+        self._tokens = min(self.tpm, self._tokens + elapsed * self.tpm / 60.0)
+        return now
+
+    async def acquire(self, tokens):
+        """Waits until a request of `tokens` fits in both budgets, then debits it."""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        tokens = min(tokens, self.tpm)  # a single oversized call must still be able to run
+        start = time.monotonic()
+        self.waiting += 1
+        try:
+            async with self._lock:
+                while True:
+                    now = self._refill()
+                    wait = self._paused_until - now
+                    if wait <= 0:
+                        wait = max(
+                            (1 - self._requests) * 60.0 / self.rpm,
+                            (tokens - self._tokens) * 60.0 / self.tpm,
+                        )
+                    if wait <= 0:
+                        self._requests -= 1
+                        self._tokens -= tokens
+                        break
+                    await asyncio.sleep(wait)
+        finally:
+            self.waiting -= 1
+        self.stats["wait_seconds"] += time.monotonic() - start
+
+    def settle(self, estimated, actual):
+        """Corrects the token bucket once the real usage of a call is known."""
+        self._refill()
+        self._tokens = min(self.tpm, self._tokens + min(estimated, self.tpm) - actual)
+        self.stats["tokens_used"] += actual
+
+    def pause(self, seconds):
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    async def run(self, call, prompt_tokens, max_retries=GROQ_MAX_RETRIES):
+        """
+        Runs a blocking Groq call (in a worker thread) once budget is available.
+
+        Args:
+            call: Zero-argument callable performing the request
+            prompt_tokens: Estimated prompt tokens; the expected completion is added on top
+        """
+        estimated = prompt_tokens + GROQ_EXPECTED_COMPLETION_TOKENS
+        for attempt in range(max_retries + 1):
+            await self.acquire(estimated)
+            try:
+                result = await run_in_threadpool(call)
+            except groq.RateLimitError as e:
+                self.stats["rate_limited"] += 1
+                self.settle(estimated, 0)
+                if attempt == max_retries:
+                    raise
+                wait = retry_after_seconds(e)
+                if wait is None:
+                    wait = random.uniform(0, min(60.0, 2 ** attempt))
+                print(f"Groq rate limited; pausing all calls for {wait:.1f}s")
+                self.pause(wait)
+                continue
+            except groq.APIError as e:
+                if not is_transient(e):
+                    raise
+                self.stats["transient_errors"] += 1
+                self.settle(estimated, 0)
+                if attempt == max_retries:
+                    raise
+                wait = random.uniform(0, min(GROQ_RETRY_MAX_DELAY, 2 ** attempt))
+                print(f"Groq call failed ({type(e).__name__}); retrying in {wait:.1f}s")
+                await asyncio.sleep(wait)
+                continue
+
+            self.stats["calls"] += 1
+            usage = getattr(result, "usage", None)
+            actual = getattr(usage, "total_tokens", None) or estimated
+            self.settle(estimated, actual)
+            return result
+
+    def snapshot(self):
+        self._refill()
+        return {
+            **self.stats,
+            "waiting": self.waiting,
+            "requests_available": round(self._requests, 2),
+            "tokens_available": round(self._tokens),
+            "rpm": self.rpm,
+            "tpm": self.tpm,
+        }
+
+
+_scheduler = None
+
+
+def get_scheduler():
+    """Returns the process-wide scheduler shared by all jobs."""
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = GroqScheduler()
+    return _scheduler
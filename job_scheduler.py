@@ -0,0 +1,232 @@
+import os
+import math
+import time
+import heapq
+import asyncio
+import itertools
+import threading
+from contextlib import asynccontextmanager
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Pipeline stages and how many jobs may run each one at the same time
+STAGES = ("convert", "transcribe", "translate", "analyse", "render")
+STAGE_WORKERS = {
+    "convert": int(os.getenv("CONVERT_CONCURRENCY", "4")),
+    "transcribe": int(os.getenv("TRANSCRIBE_WORKERS", "4")),
+    "translate": int(os.getenv("TRANSLATE_WORKERS", "4")),
+    "analyse": int(os.getenv("ANALYSE_WORKERS", "4")),
+    "render": int(os.getenv("RENDER_WORKERS", "2")),
+}
+# Jobs admitted (queued + running) before uploads are rejected with 429
+MAX_QUEUE_DEPTH = int(os.getenv("MAX_QUEUE_DEPTH", "50"))
+# Assumed job duration until real timings are available (seconds)
+DEFAULT_JOB_SECONDS = float(os.getenv("DEFAULT_JOB_SECONDS", "120"))
+
+# Shortest-job-first: each second of audio delays a job's turn by this many seconds of queue time...
+SJF_WEIGHT = float(os.getenv("SJF_WEIGHT", "1.0"))
+# ...but never by more than this, so long recordings cannot starve (aging bound, seconds)
+SJF_MAX_DELAY = float(os.getenv("SJF_MAX_DELAY", "900"))
+# Audio length assumed when the upload's duration could not be estimated (seconds)
+UNKNOWN_AUDIO_SECONDS = float(os.getenv("UNKNOWN_AUDIO_SECONDS", "300"))
+# Each step of the per-request priority moves a job this many seconds ahead in the queues
+PRIORITY_STEP_SECONDS = float(os.getenv("PRIORITY_STEP_SECONDS", "300"))
+
+
+class QueueFullError(Exception):
+    """Raised when a job is submitted while MAX_QUEUE_DEPTH jobs are already admitted."""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Job queue is full, retry in {retry_after}s")
+        self.retry_after = retry_after
+
+
+class JobCancelled(Exception):
+    """Raised by pipeline work running in threads once its job has been cancelled."""
+
+
+class StageLimiter:
+    """
+    Worker pool for one pipeline stage: at most `workers` jobs hold the stage at once.
+    Waiting jobs are served lowest priority value first, then in arrival order.
+    """
+
+    def __init__(self, name, workers):
+        self.name = name
+        self.workers = max(1, workers)
+        self.running = 0
+        self._waiters = []
+        self._seq = itertools.count()
+
+    @property
+    def waiting(self):
+        return len(self._waiters)
+
+    async def acquire(self, priority=0):
+        if self.running < self.workers and not self._waiters:
+            self.running += 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        entry = [priority, next(self._seq), future]
+        heapq.heappush(self._waiters, entry)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # The slot was handed over just before cancellation; pass it on
+                self.release()
+            else:
+                self._waiters.remove(entry)
+                heapq.heapify(self._waiters)
+            raise
+
+    def release(self):
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                # Hand the slot straight to the next waiter; running stays the same
+                future.set_result(None)
+                return
+        self.running -= 1
+
+
+class JobScheduler:
+    """
+    Admission control and per-stage worker pools for analysis jobs.
+
+    submit() admits a job or raises QueueFullError once MAX_QUEUE_DEPTH jobs are in the
+    system; stage() bounds how many admitted jobs run each stage concurrently, so fifty
+    uploads no longer mean fifty FFmpeg processes and fifty PDF renders at once.
+    """
+
+    def __init__(self, stage_workers=None, max_queue_depth=MAX_QUEUE_DEPTH):
+        stage_workers = stage_workers or STAGE_WORKERS
+        self.stages = {name: StageLimiter(name, stage_workers.get(name, 1)) for name in STAGES}
+        self.max_queue_depth = max_queue_depth
+        self.active = {}
+        self._avg_job_seconds = DEFAULT_JOB_SECONDS
+        self.stats = {"admitted": 0, "rejected": 0, "completed": 0, "cancelled": 0}
+
+    def retry_after(self):
+        """Seconds until a queue slot is likely to free up."""
+        parallelism = min(limiter.workers for limiter in self.stages.values())
+        return max(1, math.ceil(self._avg_job_seconds / parallelism))
+
+    def submit(self, job_id, duration=None, priority=0):
+        """
+        Admits a job.
+
+        Args:
+            duration: Audio length in seconds, if known; shorter jobs are served first
+            priority: Optional request priority, higher runs sooner
+        """
+        if len(self.active) >= self.max_queue_depth:
+            self.stats["rejected"] += 1
+            raise QueueFullError(self.retry_after())
+        admitted_at = time.monotonic()
+        if duration is None:
+            duration = UNKNOWN_AUDIO_SECONDS
+        self.active[job_id] = {
+            "admitted_at": admitted_at,
+            "stage": "queued",
+            "task": None,
+            "cancel_event": threading.Event(),
+            "done": asyncio.Event(),
+            "key": admitted_at + min(duration * SJF_WEIGHT, SJF_MAX_DELAY) - (priority or 0) * PRIORITY_STEP_SECONDS,
+        }
+        self.stats["admitted"] += 1
+
+    def finish(self, job_id):
+        job = self.active.pop(job_id, None)
+        if job is None:
+            return
+        job["done"].set()
+        self.stats["completed"] += 1
+        elapsed = time.monotonic() - job["admitted_at"]
+        # Exponentially weighted average keeps the retry hint current
+        self._avg_job_seconds = 0.8 * self._avg_job_seconds + 0.2 * elapsed
+
+    def attach(self, job_id, task):
+        """Registers the asyncio task running a job so that cancel() can interrupt it."""
+        job = self.active.get(job_id)
+        if job is not None:
+            job["task"] = task
+            if job["cancel_event"].is_set():
+                task.cancel()
+
+    def cancel_event(self, job_id):
+        """threading.Event that worker threads of a job poll between units of work."""
+        job = self.active.get(job_id)
+        return job["cancel_event"] if job else None
+
+    def done_event(self, job_id):
+        """asyncio.Event set by finish(), i.e. once the job's final status has been stored."""
+        job = self.active.get(job_id)
+        return job["done"] if job else None
+
+    def is_cancelled(self, job_id):
+        job = self.active.get(job_id)
+        return job is not None and job["cancel_event"].is_set()
+
+    def cancel(self, job_id):
+        """
+        Cancels a job admitted by this process: its task is cancelled at the next await
+        (releasing any stage slot it holds or waits for) and its threads stop at their
+        next check of cancel_event. Returns False if the job is not running here.
+        """
+        job = self.active.get(job_id)
+        if job is None:
+            return False
+        job["cancel_event"].set()
+        if job["task"] is not None:
+            job["task"].cancel()
+        self.stats["cancelled"] += 1
+        return True
+
+    def priority(self, job_id):
+        """
+        Ordering key for stage queues (lower runs first).
+
+        The key is the arrival time pushed back by the job's audio length (capped at
+        SJF_MAX_DELAY) and pulled forward by its request priority. Because it is anchored
+        to arrival time, a long job still overtakes every job that arrives more than
+        SJF_MAX_DELAY seconds after it, which is the aging that prevents starvation.
+        """
+        job = self.active.get(job_id)
+        return job["key"] if job else 0
+
+    @asynccontextmanager
+    async def stage(self, job_id, name):
+        limiter = self.stages[name]
+        await limiter.acquire(self.priority(job_id))
+        if job_id in self.active:
+            self.active[job_id]["stage"] = name
+        try:
+            yield
+        finally:
+            limiter.release()
+
+    def snapshot(self):
+        return {
+            **self.stats,
+            "active_jobs": len(self.active),
+            "max_queue_depth": self.max_queue_depth,
+            "avg_job_seconds": round(self._avg_job_seconds, 1),
+            "stages": {
+                name: {"workers": limiter.workers, "running": limiter.running, "waiting": limiter.waiting}
+                for name, limiter in self.stages.items()
+            },
+        }
+
+
+_scheduler = None
+
+
+def get_scheduler():
+    """Returns the process-wide job scheduler."""
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = JobScheduler()
+    return _scheduler
@@ -0,0 +1,382 @@
+import os
+import json
+import time
+import sqlite3
+import uuid
+import threading
+import progress_events
+
+# Durable job state and results (replaces the in-memory progress_store dict)
+JOB_STORE_DB = os.getenv("JOB_STORE_DB", "jobs.db")
+# Progress messages are written to disk at most this often per job (seconds), so other worker processes see them
+JOB_MESSAGE_FLUSH_SECONDS = float(os.getenv("JOB_MESSAGE_FLUSH_SECONDS", "1.0"))
+# Finished jobs stay in the in-memory hot cache this long (seconds) for late status polls
+JOB_HOT_TTL = float(os.getenv("JOB_HOT_TTL", "300"))
+# Finished jobs (and their analysis JSON) are deleted from the store after this many days; 0 keeps them forever
+JOB_RETENTION_DAYS = float(os.getenv("JOB_RETENTION_DAYS", "30"))
+# Unfinished jobs whose worker process has not sent a heartbeat for this long are taken over (seconds)
+JOB_OWNER_TIMEOUT = float(os.getenv("JOB_OWNER_TIMEOUT", "30"))
+
+# Identifies this worker process as the owner of the jobs it runs (pids are reused across restarts)
+WORKER_ID = uuid.uuid4().hex
+
+FINISHED_STATUSES = ("completed", "failed", "cancelled")
+# Columns callers may set; anything else passed to create/update is ignored
+FIELDS = ("status", "message", "filename", "upload_time", "report_id", "report_url", "error",
+          "fingerprint", "size_bytes", "duration", "priority", "spool_path", "stage_done", "batch_id")
+# Columns added after the first release, with their types, for stores created by older versions
+ADDED_COLUMNS = {"fingerprint": "TEXT", "size_bytes": "INTEGER", "duration": "REAL", "priority": "INTEGER",
+                 "cancel_requested": "INTEGER", "spool_path": "TEXT", "stage_done": "TEXT", "checkpoint": "TEXT",
+                 "owner": "TEXT", "batch_id": "TEXT"}
+
+# Hot cache of the jobs this process runs: {request_id: job dict without the result}.
+# Only the owning process writes a job, so its copy is authoritative; jobs owned by
+# other worker processes are always read from disk.
+_hot = {}
+_expires = {}
+_flushed = {}
+_lock = threading.Lock()
+
+
+def _connect():
+    # Readers in other worker processes must not block on (or be blocked by) a writer
+    conn = sqlite3.connect(JOB_STORE_DB, timeout=30)
+    conn.execute("PRAGMA busy_timeout=30000")
+    return conn
+
+
+def init_db():
+    """Creates the jobs table and drops finished jobs older than JOB_RETENTION_DAYS."""
+    os.makedirs(os.path.dirname(JOB_STORE_DB) or ".", exist_ok=True)
+    conn = _connect()
+    # WAL lets every uvicorn worker read job state while another one writes it
+    conn.execute("PRAGMA journal_mode=WAL")
+    c = conn.cursor()
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS jobs (
+            request_id TEXT PRIMARY KEY,
+            status TEXT,
+            message TEXT,
+            filename TEXT,
+            upload_time TEXT,
+            report_id TEXT,
+            report_url TEXT,
+            error TEXT,
+            fingerprint TEXT,
+            size_bytes INTEGER,
+            duration REAL,
+            priority INTEGER,
+            cancel_requested INTEGER DEFAULT 0,
+            spool_path TEXT,
+            stage_done TEXT,
+            checkpoint TEXT,
+            owner TEXT,
+            batch_id TEXT,
+            result TEXT,
+            created_at REAL,
+            updated_at REAL,
+            finished_at REAL
+        )
+    ''')
+    c.execute("PRAGMA table_info(jobs)")
+    existing = {row[1] for row in c.fetchall()}
+    for name, column_type in ADDED_COLUMNS.items():
+        if name not in existing:
+            c.execute(f"ALTER TABLE jobs ADD COLUMN {name} {column_type}")
+    c.execute("CREATE INDEX IF NOT EXISTS jobs_fingerprint ON jobs (fingerprint, status)")
+    c.execute("CREATE INDEX IF NOT EXISTS jobs_batch ON jobs (batch_id)")
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS workers (
+            worker_id TEXT PRIMARY KEY,
+            pid INTEGER,
+            heartbeat REAL
+        )
+    ''')
+    conn.commit()
+    conn.close()
+    purge_expired()
+
+
+def _write(request_id, fields, result=None, unfinished_only=False):
+    fields = dict(fields, updated_at=time.time())
+    if result is not None:
+        fields["result"] = json.dumps(result, ensure_ascii=False)
+    if fields.get("status") in FINISHED_STATUSES:
+        fields["finished_at"] = fields["updated_at"]
+        # Stage outputs are only needed to resume unfinished jobs
+        fields["checkpoint"] = None
+    condition = "request_id=?"
+    if unfinished_only:
+        condition += f" AND status NOT IN ({', '.join('?' * len(FINISHED_STATUSES))})"
+    conn = _connect()
+    c = conn.cursor()
+    c.execute(
+        f"UPDATE jobs SET {', '.join(f'{name}=?' for name in fields)} WHERE {condition}",
+        (*fields.values(), request_id, *(FINISHED_STATUSES if unfinished_only else ()))
+    )
+    conn.commit()
+    conn.close()
+
+
+def _evict_expired():
+    now = time.monotonic()
+    for request_id in [rid for rid, expiry in _expires.items() if expiry <= now]:
+        _expires.pop(request_id, None)
+        _hot.pop(request_id, None)
+        _flushed.pop(request_id, None)
+
+
+def create(request_id, **fields):
+    """Registers a new job, both in the hot cache and on disk."""
+    job = {name: fields.get(name) for name in FIELDS}
+    job["status"] = job["status"] or "queued"
+    now = time.time()
+    conn = _connect()
+    c = conn.cursor()
+    c.execute(
+        f"INSERT OR REPLACE INTO jobs (request_id, {', '.join(FIELDS)}, owner, created_at, updated_at) "
+        f"VALUES (?, {', '.join('?' * len(FIELDS))}, ?, ?, ?)",
+        (request_id, *job.values(), WORKER_ID, now, now)
+    )
+    conn.commit()
+    conn.close()
+    with _lock:
+        _evict_expired()
+        _hot[request_id] = job
+        _flushed[request_id] = time.monotonic()
+    progress_events.publish(request_id)
+
+
+def update(request_id, **fields):
+    """
+    Updates a job. Status changes are written through to disk immediately; progress
+    messages (which change several times a second) are flushed at most every
+    JOB_MESSAGE_FLUSH_SECONDS, and always together with the next status change.
+    Updates without a status are ignored once the job has finished.
+    """
+    fields = {name: value for name, value in fields.items() if name in FIELDS}
+    now = time.monotonic()
+    with _lock:
+        job = _hot.get(request_id)
+        if job is not None:
+            if job.get("status") in FINISHED_STATUSES and "status" not in fields:
+                # Late progress from work still unwinding (e.g. chunks in flight after a cancel)
+                return
+            job.update(fields)
+            fields["message"] = job["message"]
+            flush = set(fields) != {"message"} or now - _flushed.get(request_id, 0) >= JOB_MESSAGE_FLUSH_SECONDS
+            if flush:
+                _flushed[request_id] = now
+        else:
+            flush = True
+    if flush:
+        _write(request_id, fields, unfinished_only="status" not in fields)
+    progress_events.publish(request_id)
+
+
+def finish(request_id, status, result=None, **fields):
+    """
+    Marks a job completed or failed and stores its analysis result on disk.
+    The job stays in the hot cache (without the result) for JOB_HOT_TTL seconds.
+    """
+    fields = {name: value for name, value in fields.items() if name in FIELDS}
+    fields["status"] = status
+    with _lock:
+        job = _hot.get(request_id)
+        if job is not None:
+            job.update(fields)
+            _expires[request_id] = time.monotonic() + JOB_HOT_TTL
+    _write(request_id, fields, result)
+    progress_events.publish(request_id)
+
+
+def save_stage(request_id, stage, **outputs):
+    """Checkpoints the outputs of a completed pipeline stage (merged with earlier ones)."""
+    _, checkpoint = load_checkpoint(request_id)
+    checkpoint.update(outputs)
+    with _lock:
+        job = _hot.get(request_id)
+        if job is not None:
+            job["stage_done"] = stage
+    conn = _connect()
+    c = conn.cursor()
+    c.execute(
+        "UPDATE jobs SET stage_done=?, checkpoint=?, updated_at=? WHERE request_id=?",
+        (stage, json.dumps(checkpoint, ensure_ascii=False), time.time(), request_id)
+    )
+    conn.commit()
+    conn.close()
+
+
+def load_checkpoint(request_id):
+    """Returns (last completed stage or None, dict of checkpointed stage outputs)."""
+    conn = _connect()
+    c = conn.cursor()
+    c.execute("SELECT stage_done, checkpoint FROM jobs WHERE request_id=?", (request_id,))
+    row = c.fetchone()
+    conn.close()
+    if not row:
+        return None, {}
+    return row[0], json.loads(row[1]) if row[1] else {}
+
+
+def heartbeat():
+    """Records that this worker process is alive; its unfinished jobs are not taken over while it is."""
+    now = time.time()
+    conn = _connect()
+    c = conn.cursor()
+    c.execute("INSERT OR REPLACE INTO workers (worker_id, pid, heartbeat) VALUES (?, ?, ?)",
+              (WORKER_ID, os.getpid(), now))
+    c.execute("DELETE FROM workers WHERE heartbeat < ?", (now - 86400,))
+    conn.commit()
+    conn.close()
+
+
+def claim_orphans():
+    """
+    Takes over unfinished jobs whose worker process has stopped sending heartbeats
+    (crash, restart or deploy). Each job is claimed with a compare-and-set on its owner,
+    so when several workers start at once every orphan is resumed exactly once.
+
+    Returns:
+        list: Job dicts (including request_id) now owned by this process
+    """
+    cutoff = time.time() - JOB_OWNER_TIMEOUT
+    conn = _connect()
+    conn.row_factory = sqlite3.Row
+    c = conn.cursor()
+    c.execute(
+        f"SELECT request_id, owner, {', '.join(FIELDS)} FROM jobs "
+        f"WHERE status NOT IN ({', '.join('?' * len(FINISHED_STATUSES))}) "
+        "AND (owner IS NULL OR owner NOT IN (SELECT worker_id FROM workers WHERE heartbeat >= ?))",
+        (*FINISHED_STATUSES, cutoff)
+    )
+    candidates = [dict(row) for row in c.fetchall()]
+    claimed = []
+    for job in candidates:
+        c.execute("UPDATE jobs SET owner=? WHERE request_id=? AND owner IS ?",
+                  (WORKER_ID, job["request_id"], job.pop("owner")))
+        conn.commit()
+        if c.rowcount:
+            claimed.append(job)
+    conn.close()
+    now = time.monotonic()
+    with _lock:
+        for job in claimed:
+            _hot[job["request_id"]] = {name: job[name] for name in FIELDS}
+            _flushed[job["request_id"]] = now
+    return claimed
+
+
+def is_local(request_id):
+    """True if this process runs the job (and therefore publishes its progress events)."""
+    with _lock:
+        return request_id in _hot
+
+
+def get(request_id):
+    """Returns the job dict (without the analysis result), or None if unknown."""
+    with _lock:
+        _evict_expired()
+        job = _hot.get(request_id)
+        if job is not None:
+            return dict(job)
+    conn = _connect()
+    conn.row_factory = sqlite3.Row
+    c = conn.cursor()
+    c.execute(f"SELECT {', '.join(FIELDS)} FROM jobs WHERE request_id=?", (request_id,))
+    row = c.fetchone()
+    conn.close()
+    return dict(row) if row else None
+
+
+def request_cancel(request_id):
+    """Flags a job for cancellation so that whichever worker process runs it stops it."""
+    conn = _connect()
+    c = conn.cursor()
+    c.execute("UPDATE jobs SET cancel_requested=1, updated_at=? WHERE request_id=?", (time.time(), request_id))
+    conn.commit()
+    conn.close()
+
+
+def cancel_requested(request_id):
+    conn = _connect()
+    c = conn.cursor()
+    c.execute("SELECT cancel_requested FROM jobs WHERE request_id=?", (request_id,))
+    row = c.fetchone()
+    conn.close()
+    return bool(row and row[0])
+
+
+def find_completed(fingerprint):
+    """Returns the most recent completed job (including its request_id) for an upload fingerprint, or None."""
+    conn = _connect()
+    conn.row_factory = sqlite3.Row
+    c = conn.cursor()
+    c.execute(
+        f"SELECT request_id, {', '.join(FIELDS)} FROM jobs WHERE fingerprint=? AND status='completed' "
+        "ORDER BY finished_at DESC LIMIT 1",
+        (fingerprint,)
+    )
+    row = c.fetchone()
+    conn.close()
+    return dict(row) if row else None
+
+
+def batch_jobs(batch_id):
+    """Returns the jobs of a batch in submission order (without results)."""
+    conn = _connect()
+    conn.row_factory = sqlite3.Row
+    c = conn.cursor()
+    c.execute(
+        "SELECT request_id, filename, status, message, report_url, error FROM jobs WHERE batch_id=? "
+        "ORDER BY created_at, rowid",
+        (batch_id,)
+    )
+    rows = [dict(row) for row in c.fetchall()]
+    conn.close()
+    # Jobs running in this process have fresher messages in the hot cache
+    with _lock:
+        for row in rows:
+            job = _hot.get(row["request_id"])
+            if job is not None:
+                row.update({name: job[name] for name in ("status", "message", "report_url", "error")})
+    return rows
+
+
+def get_result(request_id):
+    """Returns the stored analysis dict of a completed job, or None."""
+    conn = _connect()
+    c = conn.cursor()
+    c.execute("SELECT result FROM jobs WHERE request_id=?", (request_id,))
+    row = c.fetchone()
+    conn.close()
+    return json.loads(row[0]) if row and row[0] else None
+
+
+def purge_expired():
+    """Deletes finished jobs older than JOB_RETENTION_DAYS. Returns the number removed."""
+    if JOB_RETENTION_DAYS <= 0:
+        return 0
+    cutoff = time.time() - JOB_RETENTION_DAYS * 86400
+    conn = _connect()
+    c = conn.cursor()
+    c.execute("DELETE FROM jobs WHERE finished_at IS NOT NULL AND finished_at < ?", (cutoff,))
+    removed = c.rowcount
+    conn.commit()
+    conn.close()
+    if removed:
+        print(f"Job store: purged {removed} finished jobs older than {JOB_RETENTION_DAYS:g} days")
+    return removed
+
+
+def stats():
+    conn = _connect()
+    c = conn.cursor()
+    c.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status")
+    by_status = dict(c.fetchall())
+    conn.close()
+    with _lock:
+        _evict_expired()
+        hot = len(_hot)
+    return {"jobs": by_status, "hot_entries": hot}
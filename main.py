@@ -1,12 +1,11 @@
 from fastapi import FastAPI, Request, Form, BackgroundTasks, HTTPException
 from pydantic import BaseModel
-from typing import Optional
+from typing import Optional, List
 from fastapi.responses import HTMLResponse, FileResponse, RedirectResponse, JSONResponse, StreamingResponse
 from fastapi.concurrency import run_in_threadpool
 import asyncio
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-from deep_translator import GoogleTranslator
 from textblob import TextBlob
 from fpdf import FPDF
 import os
@@ -19,12 +18,23 @@ import io
 import pandas as pd
 from fastapi import UploadFile, File
 import httpx
-import subprocess
+import zipfile
+import hashlib
+import time
 
 import database
+import analysis
+import analysis_cache
+import groq_scheduler
+import job_scheduler
+import job_store
+import progress_events
+import report_renderer
+import audio_utils
 import transcription
+import transcript_cache
+import translation
 import mongo_upload
-from pdf_generator import generate_report_v2
 
 
 app = FastAPI()
@@ -51,39 +61,53 @@ if not os.path.exists(REPORTS_DIR):
 
 
 
-# Global store for progress updates
-# Format: {request_id: "Current status message"}
-progress_store = {}
-
 database.init_db()
+job_store.init_db()
 
 @app.get("/progress/{request_id}")
 async def progress_stream(request_id: str):
+    """
+    Server-sent progress messages for a job.
+    The stream wakes only when the job publishes a change; idle streams get a keep-alive
+    comment every PROGRESS_HEARTBEAT_SECONDS. The final state is sent as a "done" event.
+    """
     async def event_generator():
-        while True:
-            if request_id in progress_store:
-                # Upgrade to handle dict or string for backward compatibility
-                data = progress_store[request_id]
-                if isinstance(data, dict):
-                    status_msg = data.get("message", "Processing...")
-                    status_state = data.get("status", "processing")
-                    
-                    yield f"data: {status_msg}\n\n"
+        loop = asyncio.get_running_loop()
+        with progress_events.subscribe(request_id) as subscription:
+            last_msg = None
+            last_sent = loop.time()
+            while True:
+                data = await run_in_threadpool(job_store.get, request_id)
+                if data:
+                    status_msg = data.get("message") or "Processing..."
+                    status_state = data.get("status") or "processing"
                     
-                    if status_state in ["completed", "failed"]:
-                         break
-                else:
-                    # Old string format support
-                    status = data
-                    if status == "COMPLETE" or status.startswith("ERROR"):
-                        yield f"data: {status}\n\n"
+                    if status_state in job_store.FINISHED_STATUSES:
+                        yield f"data: {status_msg}\n\n"
+                        done = {
+                            "status": status_state,
+                            "message": status_msg,
+                            "report_url": data.get("report_url")
+                        }
+                        yield f"event: done\ndata: {json.dumps(done)}\n\n"
                         break
-                    yield f"data: {status}\n\n"
-            else:
-                # If ID not found yet, it might be starting up
-                yield f"data: Initializing...\n\n"
-            
-            await asyncio.sleep(0.5)
+                    if status_msg != last_msg:
+                        yield f"data: {status_msg}\n\n"
+                        last_msg, last_sent = status_msg, loop.time()
+                elif last_msg is None:
+                    # If ID not found yet, it might be starting up
+                    last_msg, last_sent = "Initializing...", loop.time()
+                    yield f"data: {last_msg}\n\n"
+                
+                # Jobs run by another worker process publish no events here, so re-read them periodically
+                if data and job_store.is_local(request_id):
+                    timeout = progress_events.PROGRESS_HEARTBEAT_SECONDS
+                else:
+                    timeout = progress_events.PROGRESS_REMOTE_POLL_SECONDS
+                await subscription.wait(timeout)
+                if loop.time() - last_sent >= progress_events.PROGRESS_HEARTBEAT_SECONDS:
+                    yield ": keep-alive\n\n"
+                    last_sent = loop.time()
 
     return StreamingResponse(event_generator(), media_type="text/event-stream")
 
@@ -115,13 +139,98 @@ load_dotenv()
 
 # Initialize Groq Client
 GROQ_API_KEY = os.getenv("GROQ_API_KEY")
-client = Groq(api_key=GROQ_API_KEY)
+# Retries are handled by groq_scheduler, which honours retry-after across all jobs
+client = Groq(api_key=GROQ_API_KEY, max_retries=0)
 
 # Load API credentials for cloud upload
 API_TOKEN = os.getenv("API_TOKEN")
 API_UID = os.getenv("API_UID")
 REPORT_URL = os.getenv("report_url")
 
+# Feed FFmpeg output straight to the recognizer instead of writing a converted WAV first
+STREAMING_TRANSCRIPTION = os.getenv("STREAMING_TRANSCRIPTION", "0") == "1"
+
+# Per-conversion FFmpeg timeout (seconds); concurrency is capped by the "convert" stage of job_scheduler
+CONVERT_TIMEOUT = float(os.getenv("CONVERT_TIMEOUT", "600"))
+
+# Uploaded audio is spooled here until the pipeline has consumed it
+UPLOAD_SPOOL_DIR = os.getenv("UPLOAD_SPOOL_DIR", "uploads")
+UPLOAD_MAX_BYTES = int(float(os.getenv("UPLOAD_MAX_MB", "500")) * 1024 * 1024)
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+# Return the existing report when identical audio has already been analysed
+UPLOAD_DEDUP = os.getenv("UPLOAD_DEDUP", "1") == "1"
+
+# Batch uploads: size limit of one request (all files or the ZIP) and the audio types taken from archives
+BATCH_MAX_BYTES = int(float(os.getenv("BATCH_MAX_MB", "5000")) * 1024 * 1024)
+AUDIO_EXTENSIONS = {".wav", ".mp3", ".m4a", ".aac", ".ogg", ".opus", ".flac", ".amr", ".webm", ".wma"}
+
+# How often a running job checks the job store for a cancellation sent to another worker process (seconds)
+JOB_CANCEL_POLL_SECONDS = float(os.getenv("JOB_CANCEL_POLL_SECONDS", "2"))
+
+# Heartbeat / orphaned-job scan interval (seconds); see job_store.JOB_OWNER_TIMEOUT
+JOB_HEARTBEAT_SECONDS = float(os.getenv("JOB_HEARTBEAT_SECONDS", "10"))
+# Spooled files without an unfinished job are deleted at startup once they are this old (seconds);
+# batch archives are touched while they are being fed, so only abandoned ones ever reach this age
+SPOOL_ORPHAN_SECONDS = 3600
+
+# Strong references to jobs started outside a request (resumed after a restart)
+background_jobs = set()
+
+async def spool_upload(upload_file, dest_path, max_bytes=None):
+    """
+    Copies an upload to dest_path in chunks without blocking the event loop.
+    The size limit, SHA-256 and a header-based duration estimate are all computed in the same pass.
+    
+    Returns:
+        dict: {"size_bytes", "sha256", "duration"} (duration in seconds, None if unknown)
+    """
+    if max_bytes is None:
+        max_bytes = UPLOAD_MAX_BYTES
+    digest = hashlib.sha256()
+    head = b""
+    size = 0
+    try:
+        with open(dest_path, "wb") as buffer:
+            while True:
+                chunk = await upload_file.read(UPLOAD_CHUNK_BYTES)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    raise HTTPException(
+                        status_code=413,
+                        detail=f"File too large. Maximum upload size is {max_bytes / (1024 * 1024):g} MB."
+                    )
+                if len(head) < 65536:
+                    head += chunk[:65536 - len(head)]
+                digest.update(chunk)
+                await run_in_threadpool(buffer.write, chunk)
+    except BaseException:
+        if os.path.exists(dest_path):
+            os.remove(dest_path)
+        raise
+    return {
+        "size_bytes": size,
+        "sha256": digest.hexdigest(),
+        "duration": audio_utils.estimate_duration(head, size)
+    }
+
+class ThreadedReader:
+    """Async read() over a blocking file object (e.g. a ZIP member), for spool_upload."""
+    
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+    
+    async def read(self, size=-1):
+        return await run_in_threadpool(self.fileobj.read, size)
+
+def find_duplicate(upload):
+    """Returns the completed job that analysed identical audio, if its report still exists."""
+    existing = job_store.find_completed(upload["sha256"])
+    if existing and existing.get("report_id") and os.path.exists(os.path.join(REPORTS_DIR, existing["report_id"])):
+        return existing
+    return None
+
 async def upload_report_to_api(payload):
     """
     Upload report data to cloud API endpoint in JSON format.
@@ -177,49 +286,70 @@ async def upload_report_to_api(payload):
 
 
 
-def convert_to_wav(input_path):
+async def convert_to_wav_async(input_path, progress_callback=None, timeout=None):
     """
-    Converts any audio file to WAV format (16kHz, Mono, 16-bit PCM) using FFmpeg.
-    This ensures compatibility with the chunking logic and speech API.
+    Converts any audio file to WAV format (16kHz, Mono, 16-bit PCM) without blocking the event loop.
+    Runs FFmpeg as an asyncio subprocess,
+    reports decoded time through progress_callback and kills FFmpeg after timeout seconds.
     """
+    if timeout is None:
+        timeout = CONVERT_TIMEOUT
+    output_path = os.path.splitext(input_path)[0] + "_converted.wav"
+
+    # Already-compliant or lightly off-spec PCM WAV never needs FFmpeg
+    fast_path = audio_utils.wav_fast_path(input_path)
+    if fast_path == "passthrough":
+        print(f"{input_path} is already 16kHz mono PCM, skipping conversion.")
+        return input_path
+    if fast_path == "inprocess":
+        print(f"Converting {input_path} to {output_path} in-process...")
+        try:
+            return await run_in_threadpool(audio_utils.normalize_wav, input_path, output_path)
+        except Exception as e:
+            print(f"In-process conversion failed ({e}), falling back to FFmpeg...")
+
+    print(f"Converting {input_path} to {output_path}...")
+    command = audio_utils.ffmpeg_pcm_command(input_path, output_path)
+    # Machine-readable progress on stdout instead of the interactive stats line
+    command[1:1] = ["-nostats", "-progress", "pipe:1"]
     try:
-        output_path = os.path.splitext(input_path)[0] + "_converted.wav"
-        print(f"Converting {input_path} to {output_path}...")
-        
-        # FFmpeg command:
-        # -i input
-        # -vn (no video)
-        # -acodec pcm_s16le (16-bit PCM)
-        # -ar 16000 (16kHz sample rate)
-        # -ac 1 (Mono channel)
-        # -y (overwrite)
-        command = [
-            "ffmpeg", "-i", input_path, 
-            "-vn", 
-            "-acodec", "pcm_s16le", 
-            "-ar", "16000", 
-            "-ac", "1", 
-            "-y", 
-            output_path
-        ]
-        
-        # Run conversion
-        subprocess.run(command, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-        
-        if os.path.exists(output_path):
-            print(f"Conversion successful: {output_path}")
-            return output_path
-        else:
-            print("Conversion failed: Output file not created.")
-            return None
-            
-    except subprocess.CalledProcessError as e:
-        print(f"FFmpeg conversion failed: {e}")
-        return None
+        process = await asyncio.create_subprocess_exec(
+            *command, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL
+        )
     except Exception as e:
         print(f"Conversion error: {e}")
         return None
 
+    async def read_progress():
+        async for line in process.stdout:
+            key, _, value = line.decode(errors="ignore").strip().partition("=")
+            if key == "out_time_ms" and value.isdigit() and progress_callback:
+                progress_callback(f"Normalizing audio format... {int(value) / 1_000_000:.0f}s decoded")
+
+    try:
+        await asyncio.wait_for(asyncio.gather(read_progress(), process.wait()), timeout=timeout)
+    except asyncio.CancelledError:
+        # Job cancelled: do not leave FFmpeg running
+        process.kill()
+        await process.wait()
+        raise
+    except asyncio.TimeoutError:
+        process.kill()
+        await process.wait()
+        print(f"FFmpeg conversion timed out after {timeout:.0f}s")
+        if os.path.exists(output_path):
+            os.remove(output_path)
+        return None
+
+    if process.returncode != 0:
+        print(f"FFmpeg conversion failed with exit code {process.returncode}")
+        return None
+    if os.path.exists(output_path):
+        print(f"Conversion successful: {output_path}")
+        return output_path
+    print("Conversion failed: Output file not created.")
+    return None
+
 
 
 
@@ -231,36 +361,144 @@ def convert_to_wav(input_path):
 async def health_check():
     return {"status": "ok"}
 
+@app.get("/api/cache/stats")
+async def cache_stats():
+    """
+    Hit/miss counters of the transcript, translation and analysis caches.
+    """
+    return {
+        "transcripts": transcript_cache.stats(),
+        "translations": translation.stats(),
+        "analysis": analysis_cache.stats(),
+        "analysis_prompt_version": analysis.PROMPT_VERSION
+    }
+
+@app.get("/api/jobs/stats")
+async def job_stats():
+    """
+    Queue depth and per-stage worker usage of the job scheduler, plus job store counts.
+    """
+    return {**job_scheduler.get_scheduler().snapshot(), "store": await run_in_threadpool(job_store.stats)}
+
+@app.delete("/api/jobs/{request_id}")
+async def cancel_job(request_id: str):
+    """
+    Cancels a queued or running job. Work stops at the next stage boundary or transcription
+    chunk, FFmpeg is killed and temp files are removed; the job then reports status "cancelled".
+    """
+    data = await run_in_threadpool(job_store.get, request_id)
+    if data is None:
+        raise HTTPException(status_code=404, detail="Request ID not found")
+    if data.get("status") in job_store.FINISHED_STATUSES:
+        raise HTTPException(status_code=409, detail=f"Job already {data.get('status')}")
+    
+    await run_in_threadpool(job_store.request_cancel, request_id)
+    await run_in_threadpool(job_store.update, request_id, message="Cancelling...")
+    scheduler = job_scheduler.get_scheduler()
+    done = scheduler.done_event(request_id)
+    if scheduler.cancel(request_id):
+        # Running in this process: give run_job a moment to unwind and store "cancelled"
+        try:
+            await asyncio.wait_for(done.wait(), timeout=5)
+        except asyncio.TimeoutError:
+            pass
+    # Otherwise the worker process running the job picks the flag up within JOB_CANCEL_POLL_SECONDS
+    
+    data = await run_in_threadpool(job_store.get, request_id)
+    return {
+        "request_id": request_id,
+        "status": data.get("status") if data.get("status") == "cancelled" else "cancelling",
+        "message": data.get("message")
+    }
+
+@app.get("/api/llm/scheduler")
+async def llm_scheduler_stats():
+    """
+    Budget, queue and rate-limit counters of the shared Groq scheduler.
+    """
+    return groq_scheduler.get_scheduler().snapshot()
+
+@app.delete("/api/cache/analysis")
+async def clear_analysis_cache():
+    """
+    Invalidates all cached LLM analyses (e.g. after changing the prompt outside analysis.py).
+    """
+    removed = analysis_cache.clear()
+    return {"status": "success", "removed": removed}
+
 @app.post("/upload")
 @app.post("/api/upload")
-async def upload_audio(background_tasks: BackgroundTasks, audio_file: UploadFile = File(...)):
+async def upload_audio(request: Request, background_tasks: BackgroundTasks, audio_file: UploadFile = File(...),
+                       force: bool = False, priority: int = Form(0, ge=-10, le=10)):
     """
     API 1: Upload audio, start processing, return 200 + ID.
+    Audio identical to an already analysed upload returns the existing report unless force=true.
+    Shorter recordings are processed first; priority (-10..10, higher is sooner) overrides that.
     """
     request_id = str(uuid.uuid4())
+    
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > UPLOAD_MAX_BYTES + 64 * 1024:
+        raise HTTPException(
+            status_code=413,
+            detail=f"File too large. Maximum upload size is {UPLOAD_MAX_BYTES / (1024 * 1024):g} MB."
+        )
+    
     filename = audio_file.filename
     ext = os.path.splitext(filename)[1].lower()
     if not ext:
         ext = ".wav" # Default
         
-    temp_filename = f"temp_{request_id}{ext}"
+    os.makedirs(UPLOAD_SPOOL_DIR, exist_ok=True)
+    temp_filename = os.path.join(UPLOAD_SPOOL_DIR, f"{request_id}{ext}")
+    
+    # Save file (hashed and probed while it is written)
+    upload = await spool_upload(audio_file, temp_filename)
+    
+    # Identical audio already analysed: hand back the existing report
+    if UPLOAD_DEDUP and not force:
+        existing = await run_in_threadpool(find_duplicate, upload)
+        if existing:
+            os.remove(temp_filename)
+            print(f"Duplicate upload of {filename}; reusing analysis {existing['request_id']}")
+            return {
+                "message": "Audio already analysed",
+                "request_id": existing["request_id"],
+                "status": "completed",
+                "duplicate": True,
+                "report_url": existing.get("report_url")
+            }
     
-    # Save file
-    with open(temp_filename, "wb") as buffer:
-        shutil.copyfileobj(audio_file.file, buffer)
+    # Reject when the job queue is full instead of piling up work
+    try:
+        job_scheduler.get_scheduler().submit(request_id, upload["duration"], priority)
+    except job_scheduler.QueueFullError as e:
+        os.remove(temp_filename)
+        raise HTTPException(
+            status_code=429,
+            detail=f"Server busy: job queue is full. Retry in {e.retry_after} seconds.",
+            headers={"Retry-After": str(e.retry_after)}
+        )
         
     # Init store
-    progress_store[request_id] = {
-        "status": "queued", 
-        "message": "Upload complete. queued for processing.",
-        "filename": filename,
-        "upload_time": dt.datetime.now().isoformat()
-    }
+    await run_in_threadpool(
+        job_store.create,
+        request_id,
+        status="queued",
+        message="Upload complete. queued for processing.",
+        filename=filename,
+        upload_time=dt.datetime.now().isoformat(),
+        fingerprint=upload["sha256"],
+        size_bytes=upload["size_bytes"],
+        duration=upload["duration"],
+        priority=priority,
+        spool_path=temp_filename
+    )
     
     # Start Task
     # We need to link to the existing monolithic logic OR the new refactored one.
     # I will call a wrapper that effectively runs the logic previously in /analyze
-    background_tasks.add_task(full_analysis_pipeline, request_id, temp_filename, filename)
+    background_tasks.add_task(run_job, request_id, temp_filename, filename, upload["sha256"])
     
     return {
         "message": "Audio uploaded successfully",
@@ -268,19 +506,235 @@ async def upload_audio(background_tasks: BackgroundTasks, audio_file: UploadFile
         "status": "processing_started"
     }
 
+@app.post("/api/batch")
+async def upload_batch(files: List[UploadFile] = File(...), batch_id: Optional[str] = Form(None),
+                       force: bool = False, priority: int = Form(0, ge=-10, le=10)):
+    """
+    Batch upload: any number of audio files and/or ZIP archives of recordings.
+    Every recording gets a request_id immediately; recordings are fed into the job queue as
+    capacity frees up, and ZIP members are extracted one at a time just before they are queued.
+    Pass an existing batch_id to add more files to a batch.
+    """
+    batch_id = batch_id or str(uuid.uuid4())
+    os.makedirs(UPLOAD_SPOOL_DIR, exist_ok=True)
+    
+    entries = []
+    archives = []
+    try:
+        remaining = BATCH_MAX_BYTES
+        for audio_file in files:
+            filename = os.path.basename(audio_file.filename or "")
+            ext = os.path.splitext(filename)[1].lower()
+            if ext == ".zip":
+                # Keep the archive as-is; members are extracted lazily by feed_batch
+                archive_path = os.path.join(UPLOAD_SPOOL_DIR, f"{uuid.uuid4()}.zip")
+                info = await spool_upload(audio_file, archive_path, max_bytes=remaining)
+                archives.append(archive_path)
+                try:
+                    archive = zipfile.ZipFile(archive_path)
+                except zipfile.BadZipFile:
+                    raise HTTPException(status_code=400, detail=f"{filename} is not a valid ZIP archive")
+                remaining -= info["size_bytes"]
+                for member in archive.infolist():
+                    member_ext = os.path.splitext(member.filename)[1].lower()
+                    if member.is_dir() or member_ext not in AUDIO_EXTENSIONS or "__MACOSX" in member.filename:
+                        continue
+                    entries.append({"filename": os.path.basename(member.filename), "archive": archive_path,
+                                    "member": member.filename, "ext": member_ext})
+                archive.close()
+            else:
+                entries.append({"filename": filename, "file": audio_file, "ext": ext or ".wav"})
+        
+        jobs = []
+        for entry in entries:
+            request_id = str(uuid.uuid4())
+            entry["spool_path"] = os.path.join(UPLOAD_SPOOL_DIR, f"{request_id}{entry['ext']}")
+            await run_in_threadpool(
+                job_store.create,
+                request_id,
+                status="queued",
+                message="Waiting in batch...",
+                filename=entry["filename"],
+                upload_time=dt.datetime.now().isoformat(),
+                priority=priority,
+                batch_id=batch_id,
+                # Loose files are on disk from the start, so they can be resumed after a restart
+                spool_path=entry["spool_path"] if "file" in entry else None
+            )
+            entry["request_id"] = request_id
+            if "file" in entry:
+                # Loose files must be spooled now; the request body is gone once we return
+                try:
+                    entry["upload"] = await spool_upload(entry.pop("file"), entry["spool_path"],
+                                                         max_bytes=min(UPLOAD_MAX_BYTES, remaining))
+                    remaining -= entry["upload"]["size_bytes"]
+                except HTTPException as e:
+                    await run_in_threadpool(job_store.finish, request_id, "failed", message=e.detail, error=e.detail)
+                    entry["skip"] = True
+            jobs.append({"request_id": request_id, "filename": entry["filename"]})
+    except BaseException as e:
+        # Nothing will feed this request's recordings: drop its files and fail the jobs already created
+        detail = getattr(e, "detail", None) or str(e) or type(e).__name__
+        for archive_path in archives:
+            if os.path.exists(archive_path):
+                os.remove(archive_path)
+        for entry in entries:
+            if "request_id" not in entry or entry.get("skip"):
+                continue
+            if os.path.exists(entry["spool_path"]):
+                os.remove(entry["spool_path"])
+            try:
+                await run_in_threadpool(job_store.finish, entry["request_id"], "failed",
+                                        message=f"Batch upload failed: {detail}", error=detail)
+            except Exception as finish_err:
+                print(f"Could not mark batch job {entry['request_id']} as failed: {finish_err}")
+        raise
+    
+    task = asyncio.create_task(feed_batch([e for e in entries if not e.get("skip")], archives, force, priority))
+    background_jobs.add(task)
+    task.add_done_callback(background_jobs.discard)
+    
+    return {
+        "message": f"Batch accepted: {len(jobs)} recordings",
+        "batch_id": batch_id,
+        "status_url": f"/api/batch/{batch_id}",
+        "jobs": jobs
+    }
+
+def touch_archives(archives):
+    """Keeps archives that are still being fed younger than SPOOL_ORPHAN_SECONDS for clean_spool_dir."""
+    for archive_path in archives:
+        try:
+            os.utime(archive_path)
+        except OSError:
+            pass
+
+async def feed_batch(entries, archives, force=False, priority=0):
+    """
+    Moves batch entries into the job queue one by one, waiting while the queue is full.
+    ZIP members are extracted (hashed and probed in the same pass) only when their turn comes.
+    An entry that fails is marked failed; the rest of the batch carries on.
+    """
+    open_archives = {}
+    try:
+        for entry in entries:
+            touch_archives(archives)
+            try:
+                await feed_batch_entry(entry, open_archives, archives, force, priority)
+            except Exception as e:
+                print(f"Batch entry {entry['filename']} failed: {e}")
+                if os.path.exists(entry["spool_path"]):
+                    os.remove(entry["spool_path"])
+                try:
+                    await run_in_threadpool(job_store.finish, entry["request_id"], "failed",
+                                            message=f"Could not queue {entry['filename']}: {e}", error=str(e))
+                except Exception as finish_err:
+                    print(f"Could not mark batch job {entry['request_id']} as failed: {finish_err}")
+    finally:
+        for archive in open_archives.values():
+            archive.close()
+        for archive_path in archives:
+            if os.path.exists(archive_path):
+                os.remove(archive_path)
+
+async def feed_batch_entry(entry, open_archives, archives, force=False, priority=0):
+    """Extracts (if needed), de-duplicates and enqueues one batch entry."""
+    scheduler = job_scheduler.get_scheduler()
+    request_id = entry["request_id"]
+    spool_path = entry["spool_path"]
+    if await run_in_threadpool(job_store.cancel_requested, request_id):
+        if os.path.exists(spool_path):
+            os.remove(spool_path)
+        await run_in_threadpool(job_store.finish, request_id, "cancelled", message="Job cancelled.")
+        return
+    
+    upload = entry.get("upload")
+    if upload is None:
+        try:
+            archive = open_archives.get(entry["archive"])
+            if archive is None:
+                archive = open_archives[entry["archive"]] = zipfile.ZipFile(entry["archive"])
+            with archive.open(entry["member"]) as member:
+                upload = await spool_upload(ThreadedReader(member), spool_path)
+        except Exception as e:
+            detail = getattr(e, "detail", None) or str(e)
+            await run_in_threadpool(job_store.finish, request_id, "failed",
+                                    message=f"Could not extract {entry['member']}: {detail}", error=detail)
+            return
+    
+    if UPLOAD_DEDUP and not force:
+        existing = await run_in_threadpool(find_duplicate, upload)
+        if existing:
+            os.remove(spool_path)
+            await run_in_threadpool(
+                job_store.finish,
+                request_id,
+                "completed",
+                result=await run_in_threadpool(job_store.get_result, existing["request_id"]),
+                message=f"Already analysed (request {existing['request_id']}).",
+                report_id=existing["report_id"],
+                report_url=existing.get("report_url"),
+                fingerprint=upload["sha256"]
+            )
+            return
+    
+    while True:
+        try:
+            scheduler.submit(request_id, upload["duration"], priority)
+            break
+        except job_scheduler.QueueFullError as e:
+            await run_in_threadpool(job_store.update, request_id, message="Waiting for a free queue slot...")
+            touch_archives(archives)
+            await asyncio.sleep(min(e.retry_after, 5))
+    
+    try:
+        await run_in_threadpool(
+            job_store.update,
+            request_id,
+            message="Upload complete. queued for processing.",
+            fingerprint=upload["sha256"],
+            size_bytes=upload["size_bytes"],
+            duration=upload["duration"],
+            spool_path=spool_path
+        )
+    except BaseException:
+        scheduler.finish(request_id)
+        raise
+    task = asyncio.create_task(run_job(request_id, spool_path, entry["filename"], upload["sha256"]))
+    background_jobs.add(task)
+    task.add_done_callback(background_jobs.discard)
+
+@app.get("/api/batch/{batch_id}")
+async def get_batch_status(batch_id: str):
+    """
+    Aggregate progress of a batch plus the status of each of its recordings.
+    """
+    jobs = await run_in_threadpool(job_store.batch_jobs, batch_id)
+    if not jobs:
+        raise HTTPException(status_code=404, detail="Batch ID not found")
+    
+    counts = {}
+    for job in jobs:
+        counts[job["status"]] = counts.get(job["status"], 0) + 1
+    finished = sum(counts.get(status, 0) for status in job_store.FINISHED_STATUSES)
+    return {
+        "batch_id": batch_id,
+        "total": len(jobs),
+        "finished": finished,
+        "progress": round(finished / len(jobs), 3),
+        "status": "completed" if finished == len(jobs) else "processing",
+        "counts": counts,
+        "jobs": jobs
+    }
+
 @app.get("/api/status/{request_id}")
 async def get_status(request_id: str):
     """
     API 2: Check status of the report.
     """
-    if request_id not in progress_store:
+    data = await run_in_threadpool(job_store.get, request_id)
+    if data is None:
         raise HTTPException(status_code=404, detail="Request ID not found")
-        
-    data = progress_store[request_id]
-    
-    # Handle legacy string format if mainly used by old code (though we are moving away)
-    if isinstance(data, str):
-         return {"status": "processing", "message": data}
          
     return {
         "request_id": request_id,
@@ -295,18 +749,17 @@ async def get_report_info(request_id: str):
     """
     API 3: Get generated audio/report ID and details.
     """
-    if request_id not in progress_store:
+    data = await run_in_threadpool(job_store.get, request_id)
+    if data is None:
          raise HTTPException(status_code=404, detail="ID not found")
-         
-    data = progress_store[request_id]
     
-    if isinstance(data, str) or data.get("status") != "completed":
+    if data.get("status") != "completed":
         return {"status": "processing", "message": "Report not ready yet"}
         
     return {
         "request_id": request_id,
         "original_filename": data.get("filename"),
-        "generated_report_id": os.path.basename(data.get("report_url", "")),
+        "generated_report_id": data.get("report_id"),
         "download_url": data.get("report_url"),
         "status": "completed"
     }
@@ -314,97 +767,127 @@ async def get_report_info(request_id: str):
 # ---------------------------------------------------------
 # REFACTOR HELPER: Moving the Giant Logic Block
 # ---------------------------------------------------------
-async def full_analysis_pipeline(request_id, temp_filename, original_filename):
+async def full_analysis_pipeline(request_id, temp_filename, original_filename, source_hash=None):
     """
     Contains the logic previously in /analyze endpoint.
+    Each stage runs inside a job_scheduler worker slot; the job must already be admitted.
+    source_hash is the SHA-256 of temp_filename computed during upload, if known.
+    Stage outputs are checkpointed in job_store, so a job resumed after a restart
+    continues from its last completed stage.
     """
+    scheduler = job_scheduler.get_scheduler()
+    cancel_event = scheduler.cancel_event(request_id)
+    loop = asyncio.get_running_loop()
+    # Store writes of this job run in the threadpool (SQLite may wait on a lock), one at a time and in order
+    write_lock = asyncio.Lock()
+    
+    async def store(method, *args, **kwargs):
+        async with write_lock:
+            return await run_in_threadpool(method, request_id, *args, **kwargs)
+    
+    async def write_message(msg):
+        try:
+            await store(job_store.update, message=msg)
+        except Exception as e:
+            print(f"Could not store progress of {request_id}: {e}")
+    
+    def post_message(msg):
+        task = asyncio.create_task(write_message(msg))
+        background_jobs.add(task)
+        task.add_done_callback(background_jobs.discard)
+    
     try:
-        progress_store[request_id]["status"] = "processing"
+        await store(job_store.update, status="processing")
         
-        # 1. Convert
-        progress_store[request_id]["message"] = "Normalizing audio format..."
-        converted_path = convert_to_wav(temp_filename)
-        if not converted_path:
-             raise Exception("Conversion failed")
-             
-        # 2. Transcribe
-        progress_store[request_id]["message"] = "Transcribing..."
         def update_prog(msg):
-            if isinstance(progress_store.get(request_id), dict):
-                progress_store[request_id]["message"] = msg
+            # Called from the event loop (conversion, analysis) and from transcription threads alike
+            loop.call_soon_threadsafe(post_message, msg)
         
-        tamil_text = await run_in_threadpool(transcription.transcribe_audio_direct, converted_path, update_prog)
+        def stage(name, waiting_msg):
+            update_prog(waiting_msg)
+            return scheduler.stage(request_id, name)
         
-        # Cleanup
-        try:
-             if os.path.exists(converted_path) and converted_path != temp_filename:
-                 os.remove(converted_path)
-             if os.path.exists(temp_filename):
-                 os.remove(temp_filename)
-        except: pass
+        converted_path = None
+        def transcribe_with_translation(path, stream):
+            # Chunks are handed to the translator as soon as they are transcribed
+            translator = translation.StreamingTranslator(source="auto", target="en")
+            try:
+                for idx, text in transcription.iter_transcribe(path, update_prog, stream=stream, source_hash=source_hash,
+                                                               cancel_event=cancel_event):
+                    translator.submit(idx, text)
+            except Exception:
+                translator.close()
+                raise
+            return translator
+        
+        # Stages that finished before a restart are not run again
+        stage_done, saved = await store(job_store.load_checkpoint)
+        tamil_text = saved.get("tamil_text")
+        translated_text = saved.get("translated_text")
+        data = saved.get("analysis")
+        if stage_done:
+            print(f"Resuming job {request_id} after stage '{stage_done}'")
+        
+        if stage_done not in ("translate", "analyse"):
+            converted_path = saved.get("converted_path")
+            if converted_path and not os.path.exists(converted_path):
+                converted_path = None
+            if not converted_path and not os.path.exists(temp_filename):
+                raise Exception("Uploaded audio is no longer available, please upload it again")
+            try:
+                if converted_path:
+                    # Converted before a restart; chunks already transcribed are also checkpointed
+                    async with stage("transcribe", "Queued for transcription..."):
+                        update_prog("Transcribing...")
+                        translator = await run_in_threadpool(transcribe_with_translation, converted_path, False)
+                elif STREAMING_TRANSCRIPTION and audio_utils.wav_fast_path(temp_filename) is None:
+                    # 1+2. Decode and transcribe in one pass (holds both a convert and a transcribe slot)
+                    converted_path = temp_filename
+                    async with stage("convert", "Queued for audio decoding..."):
+                        async with stage("transcribe", "Queued for transcription..."):
+                            update_prog("Transcribing...")
+                            translator = await run_in_threadpool(transcribe_with_translation, temp_filename, True)
+                else:
+                    # 1. Convert
+                    async with stage("convert", "Queued for audio conversion..."):
+                        update_prog("Normalizing audio format...")
+                        converted_path = await convert_to_wav_async(temp_filename, update_prog)
+                    if not converted_path:
+                         raise Exception("Conversion failed")
+                    await store(job_store.save_stage, "convert", converted_path=converted_path)
+                         
+                    # 2. Transcribe, translating chunks as they complete
+                    async with stage("transcribe", "Queued for transcription..."):
+                        update_prog("Transcribing...")
+                        translator = await run_in_threadpool(transcribe_with_translation, converted_path, False)
+                
+                # 3. Finish translating the remaining chunks
+                async with stage("translate", "Queued for translation..."):
+                    update_prog("Translating...")
+                    tamil_text = translator.source_text()
+                    try:
+                        translated_text = await run_in_threadpool(translator.result)
+                    except asyncio.CancelledError:
+                        translator.close()
+                        raise
+                await store(job_store.save_stage, "translate", tamil_text=tamil_text, translated_text=translated_text)
+            finally:
+                # Cleanup
+                try:
+                     if converted_path and os.path.exists(converted_path) and converted_path != temp_filename:
+                         os.remove(converted_path)
+                     if os.path.exists(temp_filename):
+                         os.remove(temp_filename)
+                except: pass
 
         if not tamil_text: raise Exception("No text transcribed")
         
-        # 3. Translate
-        progress_store[request_id]["message"] = "Translating..."
-        translator = GoogleTranslator(source='auto', target='en')
-        translated_text = await run_in_threadpool(translator.translate, tamil_text)
-        
         # 4. Groq Analysis
-        progress_store[request_id]["message"] = "AI Analysis..."
-        
-        # (Insert Prompt logic here or simplify for this tool call - 
-        # I will refer to valid methods to avoid huge code blocks in 'replacement' if possible,
-        # but here I must include it or call a sub-function.
-        # I will assume the prompt is defined below or copied.)
-        
-        prompt = f"""
-        Analyze the sales call transcript (Tamil translated to English) and return a JSON object matching this EXACT structure.
-        
-        
-        CRITICAL DEFINITIONS FOR PROMISE CLASSIFICATION:
-        - "GOOD PROMISE": A realistic commitment (e.g., "I will check stock," "I will visit Tuesday"). Trust-building.
-        - "BAD PROMISE": False guarantees, over-committing on things outside control (e.g., "Price will NEVER change," "You will definitely get 100% refund," "No other shop has this"). Trust-damaging.
-        
-        CRITICAL RULES:
-        1. "improvement_roadmap": Must include at least 2-3 specific actionable items. NOT empty.
-        2. "product_insights": Must analyze which products were discussed.
-        3. "products_analysis": List ALL products mentioned, even generic ones.
-        
-        JSON Structure:
-        {{
-            "summary": "Detailed executive summary of the conversation.",
-            "sentiment": "Positive/Negative/Neutral",
-            "overall_score": 85,
-            "performance_metrics": {{"closing_probability": 75, "objection_handling": 60, "empathy_score": 80, "product_knowledge": 90, "conversation_control": 50}},
-            "products_analysis": [
-                {{"product": "Maida", "mentions": 5, "priority": "High"}},
-                {{"product": "Sooji", "mentions": 2, "priority": "Low"}}
-            ],
-            "product_insights": {{"total_unique": 2, "most_emphasized": "Maida", "recommendation": "Push Sooji more."}},
-            "promise_analysis": {{"good_promises_count": 1, "bad_promises_count": 0, "quality_score": "90/100", "problematic_statements": []}},
-            "improvement_roadmap": [
-                {{"category": "Closing Skills", "observation": "Did not ask for the order.", "recommendation": "Use a direct close next time.", "priority": "HIGH"}},
-                {{"category": "Product Knowledge", "observation": "Stumbled on price.", "recommendation": "Memorize price list.", "priority": "MEDIUM"}}
-            ],
-            "sentiment_details": {{"positive_percent": 60, "negative_percent": 10, "neutral_percent": 30, "enthusiasm_score": "7/10", "professional_tone": "8/10"}},
-            "top_recommendations": ["Ask for order earlier", "Mention discount scheme"],
-            "product_acceptance_data": {{"total_offered": 5, "total_accepted": 3, "acceptance_rate": 60}},
-            "next_actions": {{"rep_improvements": ["Be more confident"], "predicted_next_orders": ["50kg Maida"], "follow_up_date": "Tuesday"}}
-        }}
-        TRANSCRIPT: {translated_text}
-        """
-        
-        completion = await run_in_threadpool(
-            lambda: client.chat.completions.create(
-                model="llama-3.3-70b-versatile",
-                messages=[{"role": "user", "content": prompt}],
-                temperature=0.1,
-                response_format={"type": "json_object"},
-                max_completion_tokens=8000
-            )
-        )
-        data = json.loads(completion.choices[0].message.content)
+        if data is None:
+            async with stage("analyse", "Queued for AI analysis..."):
+                update_prog("AI Analysis...")
+                data = await analysis.analyze_transcript(client, translated_text, update_prog)
+            await store(job_store.save_stage, "analyse", analysis=data)
         
         # Unpack Data
         summary = data.get("summary", "")
@@ -420,18 +903,21 @@ async def full_analysis_pipeline(request_id, temp_filename, original_filename):
         data["tamil_text"] = tamil_text
         
         # 5. Generate PDF
-        progress_store[request_id]["message"] = "Generating PDF..."
         timestamp = dt.datetime.now().strftime("%Y%m%d_%H%M%S")
-        report_filename = f"sales_analysis_report_{timestamp}.pdf"
+        # request_id keeps reports of jobs finishing in the same second (batches) apart
+        report_filename = f"sales_analysis_report_{timestamp}_{request_id[:8]}.pdf"
         
         # Call the new generator
         try:
-            report_path = generate_report_v2(data, report_filename, original_filename)
+            async with stage("render", "Queued for PDF generation..."):
+                update_prog("Generating PDF...")
+                report_path = await report_renderer.render_report(data, report_filename, original_filename)
             
             # Persist to Database for Dashboard
             upload_date = dt.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
             salesman_name = "Sales Rep" # Default, or extract if possible from filename/transcript
-            database.add_call(
+            await run_in_threadpool(
+                database.add_call,
                 filename=original_filename,
                 upload_date=upload_date,
                 salesman_name=salesman_name,
@@ -447,18 +933,143 @@ async def full_analysis_pipeline(request_id, temp_filename, original_filename):
              if 'report_path' not in locals():
                  raise pdf_err
 
-        progress_store[request_id] = {
-            "status": "completed",
-            "message": "Analysis Complete.",
-            "generated_report_id": report_filename, # useful for "Open in Browser"
-            "report_url": f"/download/{report_filename}", # Use download endpoint
-            "filename": original_filename,
-            "full_analysis": data # Persist full rich JSON
-        }
+        await store(
+            job_store.finish,
+            "completed",
+            result=data, # Persist full rich JSON
+            message="Analysis Complete.",
+            report_id=report_filename, # useful for "Open in Browser"
+            report_url=f"/download/{report_filename}" # Use download endpoint
+        )
         
+    except job_scheduler.JobCancelled:
+        raise
     except Exception as e:
         print(f"Background Process Error: {e}")
-        progress_store[request_id] = {"status": "failed", "message": str(e), "error": str(e)}
+        await store(job_store.finish, "failed", message=str(e), error=str(e))
+
+
+def clean_spool_dir():
+    """Deletes spooled uploads left behind by jobs that finished, vanished or never started."""
+    if not os.path.isdir(UPLOAD_SPOOL_DIR):
+        return
+    now = time.time()
+    for name in os.listdir(UPLOAD_SPOOL_DIR):
+        path = os.path.join(UPLOAD_SPOOL_DIR, name)
+        if not os.path.isfile(path):
+            continue
+        request_id = name.split(".")[0].replace("_converted", "")
+        job = job_store.get(request_id)
+        if job and job.get("status") not in job_store.FINISHED_STATUSES:
+            continue
+        if job is None and now - os.path.getmtime(path) < SPOOL_ORPHAN_SECONDS:
+            continue  # possibly an upload still being written by another worker
+        try:
+            os.remove(path)
+            print(f"Removed orphaned spool file {path}")
+        except OSError:
+            pass
+
+async def resume_orphaned_jobs():
+    """
+    Re-enqueues unfinished jobs whose worker process died. They continue from the last
+    checkpointed stage, so finished transcription and LLM work is not paid for twice.
+    """
+    for job in await run_in_threadpool(job_store.claim_orphans):
+        request_id = job["request_id"]
+        if not job.get("spool_path"):
+            await run_in_threadpool(job_store.finish, request_id, "failed",
+                                    message="Interrupted by a server restart, please upload again.", error="interrupted")
+            continue
+        task = asyncio.create_task(resume_job(job))
+        background_jobs.add(task)
+        task.add_done_callback(background_jobs.discard)
+
+async def resume_job(job):
+    """Waits for a free queue slot (the job stays queued meanwhile), then runs a claimed orphan."""
+    scheduler = job_scheduler.get_scheduler()
+    request_id = job["request_id"]
+    spool_path = job["spool_path"]
+    waiting = False
+    while True:
+        if await run_in_threadpool(job_store.cancel_requested, request_id):
+            for path in (spool_path, os.path.splitext(spool_path)[0] + "_converted.wav"):
+                if os.path.exists(path):
+                    os.remove(path)
+            await run_in_threadpool(job_store.finish, request_id, "cancelled", message="Job cancelled.")
+            return
+        try:
+            scheduler.submit(request_id, job.get("duration"), job.get("priority"))
+            break
+        except job_scheduler.QueueFullError as e:
+            if not waiting:
+                waiting = True
+                await run_in_threadpool(job_store.update, request_id, status="queued",
+                                        message="Resuming after server restart: waiting for a free queue slot...")
+            await asyncio.sleep(min(e.retry_after, 5))
+    print(f"Resuming job {request_id} ({job.get('filename')}) after a restart")
+    try:
+        await run_in_threadpool(job_store.update, request_id, status="queued", message="Resuming after server restart...")
+    except BaseException:
+        scheduler.finish(request_id)
+        raise
+    await run_job(request_id, spool_path, job.get("filename"), job.get("fingerprint"))
+
+async def job_recovery_loop():
+    while True:
+        try:
+            await run_in_threadpool(job_store.heartbeat)
+            await resume_orphaned_jobs()
+        except Exception as e:
+            print(f"Job recovery error: {e}")
+        await asyncio.sleep(JOB_HEARTBEAT_SECONDS)
+
+@app.on_event("startup")
+async def start_job_recovery():
+    await run_in_threadpool(job_store.heartbeat)
+    await run_in_threadpool(clean_spool_dir)
+    task = asyncio.create_task(job_recovery_loop())
+    background_jobs.add(task)
+    await report_renderer.start()
+
+
+@app.on_event("shutdown")
+async def stop_report_renderer():
+    report_renderer.shutdown()
+
+
+async def run_job(request_id, temp_filename, original_filename, source_hash=None):
+    """
+    Runs full_analysis_pipeline as its own task so that DELETE /api/jobs/{request_id}
+    can cancel it, and releases the job's scheduler admission when it ends.
+    A cancellation requested through another worker process is picked up by polling the job store.
+    """
+    scheduler = job_scheduler.get_scheduler()
+    task = asyncio.create_task(full_analysis_pipeline(request_id, temp_filename, original_filename, source_hash))
+    scheduler.attach(request_id, task)
+    
+    async def watch_remote_cancel():
+        while True:
+            await asyncio.sleep(JOB_CANCEL_POLL_SECONDS)
+            if await run_in_threadpool(job_store.cancel_requested, request_id):
+                scheduler.cancel(request_id)
+                return
+    
+    watcher = asyncio.create_task(watch_remote_cancel())
+    try:
+        await task
+    except (asyncio.CancelledError, job_scheduler.JobCancelled):
+        if not scheduler.is_cancelled(request_id):
+            raise
+        print(f"Job {request_id} cancelled")
+        # The pipeline removes its own temp files on the way out; catch anything left behind
+        for path in (temp_filename, os.path.splitext(temp_filename)[0] + "_converted.wav"):
+            if os.path.exists(path):
+                os.remove(path)
+        await run_in_threadpool(job_store.finish, request_id, "cancelled", message="Job cancelled.")
+    finally:
+        watcher.cancel()
+        scheduler.finish(request_id)
 
 
 # --- End of Analysis Pipeline ---
@@ -573,20 +1184,15 @@ async def get_analytics_v2(request_id: str):
     """
     Returns the rich, structural JSON analysis matching the dashboard requirements.
     """
-    if request_id not in progress_store:
+    data = await run_in_threadpool(job_store.get, request_id)
+    if data is None:
         raise HTTPException(status_code=404, detail="Analysis not found")
-        
-    data = progress_store[request_id]
     
     # If processing is not complete, return status
     if data.get("status") != "completed":
-         return {"status": data.get("status", "processing"), "message": "Analysis in progress"}
+         return {"status": data.get("status") or "processing", "message": "Analysis in progress"}
     
-    result = data.get("full_analysis", {})
+    result = await run_in_threadpool(job_store.get_result, request_id) or {}
     if isinstance(result, dict):
         result["request_id"] = request_id
     return result
-
-if __name__ == "__main__":
-    import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -0,0 +1,79 @@
+import os
+import asyncio
+import threading
+from contextlib import contextmanager
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Idle SSE connections get a keep-alive comment this often (seconds)
+PROGRESS_HEARTBEAT_SECONDS = float(os.getenv("PROGRESS_HEARTBEAT_SECONDS", "15"))
+# Jobs run by another worker process publish no local events; their state is re-read this often (seconds)
+PROGRESS_REMOTE_POLL_SECONDS = float(os.getenv("PROGRESS_REMOTE_POLL_SECONDS", "2"))
+
+
+class Subscription:
+    """
+    Wake-up handle for one listener. Events are coalesced: a listener that is slower
+    than the pipeline simply reads the latest job state once it wakes.
+    """
+
+    def __init__(self, request_id):
+        self.request_id = request_id
+        self.loop = asyncio.get_running_loop()
+        self._event = asyncio.Event()
+
+    def notify(self):
+        # publish() may run in a worker thread; the event belongs to the subscriber's loop
+        self.loop.call_soon_threadsafe(self._event.set)
+
+    async def wait(self, timeout):
+        """Waits until the job changes. Returns False if timeout elapsed first."""
+        try:
+            await asyncio.wait_for(self._event.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        self._event.clear()
+        return True
+
+
+_subscribers = {}
+_lock = threading.Lock()
+
+
+@contextmanager
+def subscribe(request_id):
+    """Registers a Subscription for request_id for the duration of the with block."""
+    subscription = Subscription(request_id)
+    with _lock:
+        _subscribers.setdefault(request_id, set()).add(subscription)
+    try:
+        yield subscription
+    finally:
+        with _lock:
+            listeners = _subscribers.get(request_id)
+            if listeners is not None:
+                listeners.discard(subscription)
+                if not listeners:
+                    del _subscribers[request_id]
+
+
+def publish(request_id):
+    """Wakes every listener of request_id. Safe to call from any thread; free when nobody listens."""
+    with _lock:
+        listeners = list(_subscribers.get(request_id, ()))
+    for subscription in listeners:
+        try:
+            subscription.notify()
+        except RuntimeError:
+            # The listener's event loop has already shut down
+            pass
+
+
+def stats():
+    with _lock:
+        return {
+            "jobs_watched": len(_subscribers),
+            "subscribers": sum(len(listeners) for listeners in _subscribers.values()),
+        }
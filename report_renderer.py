@@ -0,0 +1,148 @@
+import os
+import asyncio
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dotenv import load_dotenv
+
+import job_scheduler
+
+# Load environment variables
+load_dotenv()
+
+# Worker processes rendering PDF reports (0 = render in a thread of the web process).
+# Never fewer than the render stage admits at once: a render must not wait for a free worker
+# while RENDER_TIMEOUT is already running
+RENDER_PROCESSES = int(os.getenv("RENDER_PROCESSES", str(job_scheduler.STAGE_WORKERS["render"])))
+if RENDER_PROCESSES > 0:
+    RENDER_PROCESSES = max(RENDER_PROCESSES, job_scheduler.STAGE_WORKERS["render"])
+# A single report taking longer than this is abandoned and its worker process killed (seconds)
+RENDER_TIMEOUT = float(os.getenv("RENDER_TIMEOUT", "120"))
+
+# Small report rendered once by every worker at start-up so the first real job does not pay for it
+WARM_UP_DATA = {
+    "summary": "Warm-up",
+    "overall_score": 0,
+    "products_analysis": [{"product": "Warm-up", "mentions": 1}],
+    "translated_text": "Warm-up",
+    "tamil_text": "வணக்கம்",
+}
+
+
+class RenderTimeout(Exception):
+    """Raised when a report is not rendered within RENDER_TIMEOUT seconds."""
+
+
+def _warm_up():
+    """
+    Pool initializer: imports fpdf and matplotlib and renders one throwaway report,
+    which loads the fonts, builds matplotlib's font cache and touches every code path once.
+    """
+    import pdf_generator
+
+    warm_up_filename = f"_warm_up_{os.getpid()}.pdf"
+    try:
+        path = pdf_generator.generate_report_v2(dict(WARM_UP_DATA), warm_up_filename, "warm-up")
+        os.remove(path)
+    except Exception as e:
+        # A failing warm-up only costs speed; the real render reports the actual error
+        print(f"[WARNING] PDF worker warm-up failed: {e}")
+
+
+def _ready():
+    return os.getpid()
+
+
+def _render(data, report_filename, original_filename):
+    import pdf_generator
+    return pdf_generator.generate_report_v2(data, report_filename, original_filename)
+
+
+_executor = None
+_lock = threading.Lock()
+
+
+def get_executor():
+    """Returns the shared process pool, creating it on first use."""
+    global _executor
+    with _lock:
+        if _executor is None:
+            # spawn: the web process runs threads, which do not survive a fork safely
+            _executor = ProcessPoolExecutor(
+                max_workers=RENDER_PROCESSES,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_warm_up,
+            )
+        return _executor
+
+
+def _discard_executor(executor):
+    """Kills the workers of a broken or stuck pool; the next render starts a fresh one."""
+    global _executor
+    with _lock:
+        if _executor is executor:
+            _executor = None
+    # Stuck workers never return, so shutdown() alone would leave them running
+    for process in list((getattr(executor, "_processes", None) or {}).values()):
+        process.kill()
+    # Jobs still waiting in this pool fail with BrokenProcessPool and retry in the new one
+    executor.shutdown(wait=False)
+
+
+async def start():
+    """Starts and warms up every worker process ahead of the first job."""
+    if RENDER_PROCESSES <= 0:
+        return
+    loop = asyncio.get_running_loop()
+    executor = get_executor()
+    try:
+        pids = await asyncio.gather(*[loop.run_in_executor(executor, _ready) for _ in range(RENDER_PROCESSES)])
+        print(f"PDF render pool ready ({len(set(pids))} worker processes)")
+    except BrokenProcessPool as e:
+        print(f"PDF render pool failed to start: {e}")
+        _discard_executor(executor)
+
+
+def shutdown():
+    global _executor
+    with _lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+async def render_report(data, report_filename, original_filename="Unknown"):
+    """
+    Renders a PDF report in the worker pool, keeping the event loop and the web process's
+    GIL free while fpdf and matplotlib run.
+
+    Args:
+        data: Analysis result dict, as accepted by generate_report_v2
+        report_filename: File name of the report inside reports/
+        original_filename: Name of the uploaded recording, printed on the report
+
+    Returns:
+        str: Path of the written report
+
+    Raises:
+        RenderTimeout: The report was not finished within RENDER_TIMEOUT seconds
+    """
+    loop = asyncio.get_running_loop()
+    if RENDER_PROCESSES <= 0:
+        return await asyncio.to_thread(_render, data, report_filename, original_filename)
+
+    # One retry: a pool broken by another job's crashed or killed worker is replaced
+    for attempt in range(2):
+        executor = get_executor()
+        future = loop.run_in_executor(executor, _render, data, report_filename, original_filename)
+        try:
+            return await asyncio.wait_for(future, RENDER_TIMEOUT)
+        except asyncio.TimeoutError:
+            _discard_executor(executor)
+            raise RenderTimeout(f"PDF rendering took longer than {RENDER_TIMEOUT:.0f}s")
+        except BrokenProcessPool:
+            _discard_executor(executor)
+            if attempt:
+                raise
+            print("PDF render pool broke, retrying with a new pool")
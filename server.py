@@ -0,0 +1,14 @@
+import os
+import uvicorn
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Number of uvicorn worker processes; job state lives in job_store, so any of them can answer status requests
+WEB_WORKERS = int(os.getenv("WEB_WORKERS", "1"))
+
+# Kept separate from main.py: process pools started with "spawn" (report_renderer) re-import
+# the __main__ module in every child, which must not rebuild the whole application
+if __name__ == "__main__":
+    uvicorn.run("main:app", host="0.0.0.0", port=8000, workers=WEB_WORKERS)
@@ -0,0 +1,189 @@
+import os
+import random
+import hashlib
+import itertools
+import threading
+import time
+from google.api_core import exceptions as gcp_exceptions
+from google.cloud import speech
+from google.cloud.speech_v1 import types
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Initialize Google Cloud credentials
+credentials_path = os.getenv('GOOGLE_APPLICATION_CREDENTIALS', 'gcp-credentials.json')
+if os.path.exists(credentials_path):
+    os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = credentials_path
+else:
+    print(f"Warning: Google Cloud credentials file not found at {credentials_path}")
+
+# Which backend transcription uses: "google" or "stub" (offline, deterministic)
+SPEECH_BACKEND = os.getenv("SPEECH_BACKEND", "google").lower()
+
+# Shared SpeechClient pool (clients are thread-safe; >1 spreads load over several gRPC channels)
+SPEECH_CLIENT_POOL_SIZE = max(1, int(os.getenv("SPEECH_CLIENT_POOL_SIZE", "1")))
+
+# Errors that indicate broken credentials; the client is rebuilt on next use.
+# ServiceUnavailable is transient and retried on the same client (see transcription.RETRYABLE_CHUNK_ERRORS).
+UNHEALTHY_CLIENT_ERRORS = (gcp_exceptions.Unauthenticated,)
+
+# Stub backend behaviour
+STUB_LATENCY = float(os.getenv("STUB_SPEECH_LATENCY", "0.2"))  # seconds per request
+STUB_ERROR_RATE = float(os.getenv("STUB_SPEECH_ERROR_RATE", "0.0"))  # probability of a transient error
+STUB_SEED = int(os.getenv("STUB_SPEECH_SEED", "0"))
+
+_client_pool = [None] * SPEECH_CLIENT_POOL_SIZE
+_client_lock = threading.Lock()
+_client_counter = itertools.count()
+
+
+def get_speech_client():
+    """
+    Returns a shared SpeechClient, creating it lazily on first use.
+    Credentials and the gRPC channel are set up once per pool slot instead of once per job.
+    """
+    slot = next(_client_counter) % SPEECH_CLIENT_POOL_SIZE
+    with _client_lock:
+        client = _client_pool[slot]
+        if client is None:
+            print(f"Creating Speech client (pool slot {slot})...")
+            client = speech.SpeechClient()
+            _client_pool[slot] = client
+    return client
+
+
+def discard_speech_client(client):
+    """
+    Drops an unhealthy client from the pool so the next caller gets a fresh one.
+    The transport is not closed here: other chunk threads may still be using the client,
+    and its channel is closed once the last reference to it goes away.
+    """
+    with _client_lock:
+        for slot, pooled in enumerate(_client_pool):
+            if pooled is client:
+                _client_pool[slot] = None
+                print(f"Discarded unhealthy Speech client (pool slot {slot})")
+
+
+def is_closed_channel_error(error):
+    """True for the ValueError gRPC raises when a call is made on a closed channel."""
+    return isinstance(error, ValueError) and "closed channel" in str(error)
+
+
+class SpeechBackend:
+    """
+    Interface used by transcription.py. Both methods return a list of transcript parts.
+    Transient failures should raise errors listed in transcription.RETRYABLE_CHUNK_ERRORS.
+    """
+    name = "base"
+
+    def recognize(self, content, encoding, sample_rate, channels, language_code):
+        """Synchronous recognition of up to ~60s of audio."""
+        raise NotImplementedError
+
+    def recognize_long(self, content, encoding, language_code):
+        """Long-running recognition of a whole (possibly compressed) file."""
+        raise NotImplementedError
+
+
+class GoogleSpeechBackend(SpeechBackend):
+    name = "google"
+
+    def _call(self, method, config, audio):
+        for attempt in range(2):
+            client = get_speech_client()
+            try:
+                return method(client)(config=config, audio=audio)
+            except UNHEALTHY_CLIENT_ERRORS:
+                discard_speech_client(client)
+                raise
+            except ValueError as e:
+                # The channel itself has failed: replace the client and retry once on a fresh one
+                if not is_closed_channel_error(e) or attempt:
+                    raise
+                discard_speech_client(client)
+
+    def recognize(self, content, encoding, sample_rate, channels, language_code):
+        audio = types.RecognitionAudio(content=content)
+        config = types.RecognitionConfig(
+            encoding=types.RecognitionConfig.AudioEncoding[encoding],
+            sample_rate_hertz=sample_rate,
+            language_code=language_code,
+            audio_channel_count=channels
+        )
+        response = self._call(lambda client: client.recognize, config, audio)
+        return [result.alternatives[0].transcript for result in response.results]
+
+    def recognize_long(self, content, encoding, language_code):
+        audio = types.RecognitionAudio(content=content)
+        config = types.RecognitionConfig(
+            encoding=types.RecognitionConfig.AudioEncoding[encoding],
+            language_code=language_code
+        )
+        operation = self._call(lambda client: client.long_running_recognize, config, audio)
+        response = operation.result()
+        return [result.alternatives[0].transcript for result in response.results]
+
+
+class StubSpeechBackend(SpeechBackend):
+    """
+    Offline backend for load tests and benchmarks.
+    Returns text derived from a hash of the audio (same audio -> same transcript),
+    sleeps `latency` seconds per request and raises a transient ConnectionError
+    with probability `error_rate` (drawn from a seeded generator).
+    """
+    name = "stub"
+
+    WORDS = ["vanakkam", "sir", "maida", "sooji", "order", "price", "delivery", "tuesday",
+             "stock", "discount", "kilo", "bag", "shop", "payment", "nandri"]
+
+    def __init__(self, latency=None, error_rate=None, seed=None):
+        self.latency = STUB_LATENCY if latency is None else latency
+        self.error_rate = STUB_ERROR_RATE if error_rate is None else error_rate
+        self._rng = random.Random(STUB_SEED if seed is None else seed)
+        self._lock = threading.Lock()
+        self.calls = 0
+
+    def _respond(self, content):
+        with self._lock:
+            self.calls += 1
+            fail = self._rng.random() < self.error_rate
+        if self.latency:
+            time.sleep(self.latency)
+        if fail:
+            raise ConnectionError("Stub speech backend: simulated transient failure")
+        digest = hashlib.sha256(content).digest()
+        n_words = 4 + digest[0] % 8
+        return [" ".join(self.WORDS[b % len(self.WORDS)] for b in digest[1:1 + n_words])]
+
+    def recognize(self, content, encoding, sample_rate, channels, language_code):
+        return self._respond(content)
+
+    def recognize_long(self, content, encoding, language_code):
+        return self._respond(content)
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    """Returns the process-wide backend selected by SPEECH_BACKEND."""
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            if SPEECH_BACKEND == "stub":
+                print("Using stub speech backend (no network calls).")
+                _backend = StubSpeechBackend()
+            else:
+                _backend = GoogleSpeechBackend()
+    return _backend
+
+
+def set_backend(backend):
+    """Replaces the process-wide backend (used by benchmarks)."""
+    global _backend
+    with _backend_lock:
+        _backend = backend
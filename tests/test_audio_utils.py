@@ -0,0 +1,42 @@
+import numpy as np
+
+import audio_utils
+
+RATE = 16000
+
+
+def speech(seconds, level=3000.0):
+    # Tone with a syllable-like envelope: loud, but with short dips
+    t = np.arange(int(seconds * RATE)) / RATE
+    envelope = 0.6 + 0.4 * np.sin(2 * np.pi * 3 * t)
+    return level * np.sqrt(2) * envelope * np.sin(2 * np.pi * 220 * t)
+
+
+def dead_air(seconds, level=80.0, seed=0):
+    # Line hiss just above SILENCE_RMS_FLOOR
+    return np.random.default_rng(seed).normal(0.0, level, int(seconds * RATE))
+
+
+def pcm(*parts):
+    return np.clip(np.concatenate(parts), -32768, 32767).astype(np.int16).tobytes()
+
+
+def seconds_uploaded(chunks):
+    return sum(len(chunk) for chunk in chunks) / 2 / RATE
+
+
+def test_streaming_drops_dead_air_segments():
+    frames = pcm(speech(20), dead_air(240), speech(40))
+    blocks = (frames[i:i + 64000] for i in range(0, len(frames), 64000))
+    uploaded = seconds_uploaded(audio_utils.iter_pcm_chunks(blocks, RATE))
+    assert 58 < uploaded < 65
+
+
+def test_whole_file_drops_dead_air():
+    chunks = audio_utils.split_on_silence(pcm(speech(10), dead_air(290)), RATE, 1)
+    assert 9 < seconds_uploaded(chunks) < 12
+
+
+def test_quiet_continuous_recording_is_kept():
+    chunks = audio_utils.split_on_silence(pcm(speech(60, level=106.0)), RATE, 1)
+    assert seconds_uploaded(chunks) > 59
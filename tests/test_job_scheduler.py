@@ -0,0 +1,188 @@
+import asyncio
+import types
+
+import pytest
+
+import job_scheduler
+from job_scheduler import JobScheduler, QueueFullError, StageLimiter
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Replaces the scheduler's clock (only job_scheduler's, asyncio keeps the real one)."""
+    now = [1000.0]
+    monkeypatch.setattr(job_scheduler, "time", types.SimpleNamespace(monotonic=lambda: now[0]))
+    return now
+
+
+async def hold(limiter, order, name, priority=0, release=None):
+    await limiter.acquire(priority)
+    order.append(name)
+    if release is not None:
+        await release.wait()
+    limiter.release()
+
+
+def test_cancelled_waiter_passes_slot_on():
+    async def scenario():
+        limiter = StageLimiter("render", 1)
+        order = []
+        release_a = asyncio.Event()
+        a = asyncio.create_task(hold(limiter, order, "a", release=release_a))
+        await asyncio.sleep(0)
+        b = asyncio.create_task(hold(limiter, order, "b"))
+        c = asyncio.create_task(hold(limiter, order, "c"))
+        await asyncio.sleep(0)
+        assert limiter.waiting == 2
+
+        b.cancel()
+        release_a.set()
+        await asyncio.gather(a, c)
+        with pytest.raises(asyncio.CancelledError):
+            await b
+        return order, limiter.running, limiter.waiting
+
+    assert run(scenario()) == (["a", "c"], 0, 0)
+
+
+def test_slot_handed_over_just_before_cancel_is_released():
+    async def scenario():
+        limiter = StageLimiter("render", 1)
+        order = []
+        await limiter.acquire()
+        b = asyncio.create_task(hold(limiter, order, "b"))
+        c = asyncio.create_task(hold(limiter, order, "c"))
+        await asyncio.sleep(0)
+
+        # b is handed the slot and cancelled before it gets to run
+        limiter.release()
+        b.cancel()
+        await c
+        with pytest.raises(asyncio.CancelledError):
+            await b
+        return order, limiter.running
+
+    assert run(scenario()) == (["c"], 0)
+
+
+def test_waiters_served_by_priority_then_arrival():
+    async def scenario():
+        limiter = StageLimiter("render", 1)
+        order = []
+        await limiter.acquire()
+        tasks = [asyncio.create_task(hold(limiter, order, name, priority))
+                 for name, priority in (("late", 5), ("first", 1), ("second", 1))]
+        await asyncio.sleep(0)
+        limiter.release()
+        await asyncio.gather(*tasks)
+        return order
+
+    assert run(scenario()) == ["first", "second", "late"]
+
+
+def test_queue_full_rejects_until_a_job_finishes():
+    scheduler = JobScheduler(max_queue_depth=2)
+    scheduler.submit("a")
+    scheduler.submit("b")
+    with pytest.raises(QueueFullError) as excinfo:
+        scheduler.submit("c")
+    assert excinfo.value.retry_after >= 1
+    assert scheduler.stats["rejected"] == 1
+
+    scheduler.finish("a")
+    scheduler.submit("c")
+    assert set(scheduler.active) == {"b", "c"}
+
+
+def test_shorter_recordings_run_first(clock):
+    async def scenario():
+        scheduler = JobScheduler(stage_workers={"render": 1})
+        order = []
+        for job_id, duration in (("holder", 10), ("long", 1200), ("short", 60), ("unknown", None)):
+            scheduler.submit(job_id, duration)
+            clock[0] += 1
+
+        async def job(job_id, release=None):
+            async with scheduler.stage(job_id, "render"):
+                order.append(job_id)
+                if release is not None:
+                    await release.wait()
+
+        release = asyncio.Event()
+        holder = asyncio.create_task(job("holder", release))
+        await asyncio.sleep(0)
+        tasks = [asyncio.create_task(job(job_id)) for job_id in ("long", "unknown", "short")]
+        await asyncio.sleep(0)
+        release.set()
+        await asyncio.gather(holder, *tasks)
+        return order
+
+    assert run(scenario()) == ["holder", "short", "unknown", "long"]
+
+
+def test_long_job_is_not_starved(clock, monkeypatch):
+    monkeypatch.setattr(job_scheduler, "SJF_MAX_DELAY", 900)
+    scheduler = JobScheduler()
+    scheduler.submit("long", 3600)
+    clock[0] += 898
+    scheduler.submit("short_soon", 1)
+    clock[0] += 2
+    scheduler.submit("short_late", 1)
+
+    # The delay is capped, so only jobs arriving within SJF_MAX_DELAY overtake the long one
+    assert scheduler.priority("short_soon") < scheduler.priority("long") < scheduler.priority("short_late")
+
+
+def test_request_priority_moves_job_ahead(clock):
+    scheduler = JobScheduler()
+    scheduler.submit("normal", 60)
+    scheduler.submit("urgent", 600, priority=2)
+    assert scheduler.priority("urgent") < scheduler.priority("normal")
+
+
+def test_cancel_releases_waiting_job():
+    async def scenario():
+        scheduler = JobScheduler(stage_workers={"render": 1})
+        for job_id in ("a", "b", "c"):
+            scheduler.submit(job_id)
+        order = []
+        release = asyncio.Event()
+
+        async def job(job_id, wait=False):
+            async with scheduler.stage(job_id, "render"):
+                order.append(job_id)
+                if wait:
+                    await release.wait()
+
+        a = asyncio.create_task(job("a", wait=True))
+        await asyncio.sleep(0)
+        b = asyncio.create_task(job("b"))
+        c = asyncio.create_task(job("c"))
+        await asyncio.sleep(0)
+        scheduler.attach("b", b)
+        assert scheduler.cancel("b")
+        assert scheduler.is_cancelled("b")
+        release.set()
+        await asyncio.gather(a, c)
+        with pytest.raises(asyncio.CancelledError):
+            await b
+        return order, scheduler.stages["render"].running
+
+    assert run(scenario()) == (["a", "c"], 0)
+
+
+def test_done_event_is_set_when_job_finishes():
+    async def scenario():
+        scheduler = JobScheduler(max_queue_depth=2)
+        scheduler.submit("a")
+        done = scheduler.done_event("a")
+        assert not done.is_set()
+        scheduler.finish("a")
+        assert done.is_set()
+        assert scheduler.done_event("a") is None
+
+    run(scenario())
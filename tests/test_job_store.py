@@ -0,0 +1,65 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+import job_store
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Stands in for one worker process: registers a heartbeat, then claims orphans
+CLAIM_SCRIPT = """
+import json, job_store
+job_store.init_db()
+job_store.heartbeat()
+print(json.dumps([job["request_id"] for job in job_store.claim_orphans()]))
+"""
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(job_store, "JOB_STORE_DB", str(tmp_path / "jobs.db"))
+    monkeypatch.setattr(job_store, "_hot", {})
+    monkeypatch.setattr(job_store, "_expires", {})
+    monkeypatch.setattr(job_store, "_flushed", {})
+    job_store.init_db()
+    return tmp_path / "jobs.db"
+
+
+def test_orphans_are_claimed_exactly_once(store):
+    # Jobs of a worker that never sent a heartbeat (e.g. crashed before its first one)
+    ids = [f"job-{i}" for i in range(40)]
+    for request_id in ids:
+        job_store.create(request_id, status="processing", spool_path=f"uploads/{request_id}.wav")
+    job_store.create("done", status="processing")
+    job_store.finish("done", "completed")
+
+    env = dict(os.environ, JOB_STORE_DB=str(store))
+    workers = [subprocess.Popen([sys.executable, "-c", CLAIM_SCRIPT], cwd=ROOT, env=env,
+                                stdout=subprocess.PIPE, text=True) for _ in range(4)]
+    claimed = []
+    for worker in workers:
+        out, _ = worker.communicate(timeout=60)
+        assert worker.returncode == 0
+        claimed.extend(json.loads(out.strip().splitlines()[-1]))
+
+    assert sorted(claimed) == sorted(ids)
+
+
+def test_jobs_of_live_workers_are_not_claimed(store):
+    job_store.heartbeat()
+    job_store.create("running", status="processing")
+    assert job_store.claim_orphans() == []
+
+
+def test_late_messages_do_not_overwrite_finished_jobs(store):
+    job_store.create("job", status="processing")
+    job_store.finish("job", "cancelled", message="Job cancelled.")
+    job_store.update("job", message="Transcribed chunk 3/13...")
+    assert job_store.get("job")["message"] == "Job cancelled."
+
+    job_store._hot.clear()
+    job_store.update("job", message="Transcribed chunk 4/13...")
+    assert job_store.get("job")["message"] == "Job cancelled."
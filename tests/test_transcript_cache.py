@@ -0,0 +1,24 @@
+import os
+import time
+
+import audio_utils
+import transcript_cache
+
+
+def test_stale_checkpoints_are_purged(tmp_path, monkeypatch):
+    monkeypatch.setattr(transcript_cache, "CHECKPOINT_DIR", str(tmp_path))
+    transcript_cache.save_checkpoint_chunk("stale", 0, ["hello"])
+    transcript_cache.save_checkpoint_chunk("fresh", 0, ["world"])
+    old = time.time() - 4 * 24 * 3600
+    os.utime(tmp_path / "stale.json", (old, old))
+
+    assert transcript_cache.purge_checkpoints(max_age_hours=72) == 1
+    assert transcript_cache.load_checkpoint("stale") == {}
+    assert transcript_cache.load_checkpoint("fresh") == {0: ["world"]}
+
+
+def test_chunking_settings_change_the_checkpoint_signature(monkeypatch):
+    before = audio_utils.chunking_signature()
+    monkeypatch.setattr(audio_utils, "SILENCE_RMS_FLOOR", 200.0)
+    assert audio_utils.chunking_signature() != before
+    assert audio_utils.chunking_signature(silence_split=False) != before
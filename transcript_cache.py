@@ -0,0 +1,205 @@
+import os
+import json
+import hashlib
+import threading
+import time
+import wave
+
+# On-disk transcript cache settings
+CACHE_ENABLED = os.getenv("TRANSCRIPT_CACHE", "1") == "1"
+CACHE_DIR = os.getenv("TRANSCRIPT_CACHE_DIR", os.path.join("cache", "transcripts"))
+CACHE_MAX_BYTES = int(float(os.getenv("TRANSCRIPT_CACHE_MAX_MB", "100")) * 1024 * 1024)
+
+# Per-chunk checkpoints of unfinished transcriptions
+CHECKPOINT_DIR = os.getenv("TRANSCRIPT_CHECKPOINT_DIR", os.path.join("cache", "checkpoints"))
+# Checkpoints not written for this long belong to transcriptions that were given up on (hours)
+CHECKPOINT_MAX_AGE_HOURS = float(os.getenv("TRANSCRIPT_CHECKPOINT_MAX_AGE_HOURS", "72"))
+
+HASH_BLOCK_FRAMES = 16000 * 10  # ~10s of 16kHz audio per read
+
+_lock = threading.Lock()
+_checkpoint_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+
+def audio_fingerprint(file_path):
+    """
+    Returns a SHA-256 of the audio content.
+    For WAV files only the PCM frames and format are hashed, so the same
+    recording re-exported with different header metadata still matches.
+    """
+    sha = hashlib.sha256()
+    try:
+        with wave.open(file_path, "rb") as wf:
+            sha.update(f"{wf.getframerate()}:{wf.getnchannels()}:{wf.getsampwidth()}".encode())
+            while True:
+                frames = wf.readframes(HASH_BLOCK_FRAMES)
+                if not frames:
+                    break
+                sha.update(frames)
+        return sha.hexdigest()
+    except (wave.Error, EOFError):
+        return file_sha256(file_path)
+
+
+def file_sha256(file_path):
+    """Returns a SHA-256 of the raw file bytes."""
+    sha = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def make_key(fingerprint, language_code, backend="google"):
+    """Cache key of a transcript; other speech backends (e.g. the stub) never share entries with Google's."""
+    if backend != "google":
+        language_code = f"{language_code}:{backend}"
+    return hashlib.sha256(f"{fingerprint}:{language_code}".encode()).hexdigest()
+
+
+def _entry_path(key):
+    return os.path.join(CACHE_DIR, f"{key}.json")
+
+
+def get(key):
+    """Returns the cached transcript for key, or None. Hits refresh the entry's LRU position."""
+    path = _entry_path(key)
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            entry = json.load(f)
+        os.utime(path, None)
+    except (OSError, ValueError):
+        with _lock:
+            _stats["misses"] += 1
+        return None
+
+    with _lock:
+        _stats["hits"] += 1
+    return entry.get("transcript")
+
+
+def put(key, transcript, language_code=None):
+    """Stores a transcript and evicts least recently used entries above CACHE_MAX_BYTES."""
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    path = _entry_path(key)
+    tmp_path = f"{path}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"transcript": transcript, "language_code": language_code}, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+    _evict()
+
+
+def _list_entries():
+    entries = []
+    try:
+        names = os.listdir(CACHE_DIR)
+    except OSError:
+        return entries
+    for name in names:
+        if not name.endswith(".json"):
+            continue
+        path = os.path.join(CACHE_DIR, name)
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        entries.append((st.st_mtime, st.st_size, path))
+    return entries
+
+
+def _evict():
+    with _lock:
+        entries = _list_entries()
+        total = sum(size for _, size, _ in entries)
+        if total <= CACHE_MAX_BYTES:
+            return
+        for _, size, path in sorted(entries):
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            _stats["evictions"] += 1
+            if total <= CACHE_MAX_BYTES:
+                break
+
+
+def stats():
+    """Returns hit/miss counters plus the current size of the cache."""
+    entries = _list_entries()
+    with _lock:
+        result = dict(_stats)
+    lookups = result["hits"] + result["misses"]
+    result["hit_rate"] = round(result["hits"] / lookups, 3) if lookups else 0.0
+    result["entries"] = len(entries)
+    result["size_bytes"] = sum(size for _, size, _ in entries)
+    result["max_bytes"] = CACHE_MAX_BYTES
+    return result
+
+
+def clear():
+    """Removes every cached transcript."""
+    with _lock:
+        for _, _, path in _list_entries():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+def _checkpoint_path(key):
+    return os.path.join(CHECKPOINT_DIR, f"{key}.json")
+
+
+def load_checkpoint(key):
+    """Returns {chunk_index: transcript_parts} saved for an unfinished transcription."""
+    try:
+        with open(_checkpoint_path(key), "r", encoding="utf-8") as f:
+            saved = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return {int(idx): parts for idx, parts in saved.get("chunks", {}).items()}
+
+
+def save_checkpoint_chunk(key, idx, parts):
+    """Records one completed chunk. Safe to call from several worker threads."""
+    with _checkpoint_lock:
+        chunks = load_checkpoint(key)
+        chunks[idx] = parts
+        os.makedirs(CHECKPOINT_DIR, exist_ok=True)
+        path = _checkpoint_path(key)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"chunks": {str(i): p for i, p in chunks.items()}}, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+
+def clear_checkpoint(key):
+    with _checkpoint_lock:
+        try:
+            os.remove(_checkpoint_path(key))
+        except OSError:
+            pass
+
+
+def purge_checkpoints(max_age_hours=None):
+    """Removes checkpoints (and leftover temp files) older than CHECKPOINT_MAX_AGE_HOURS."""
+    if max_age_hours is None:
+        max_age_hours = CHECKPOINT_MAX_AGE_HOURS
+    cutoff = time.time() - max_age_hours * 3600
+    removed = 0
+    with _checkpoint_lock:
+        try:
+            names = os.listdir(CHECKPOINT_DIR)
+        except OSError:
+            return 0
+        for name in names:
+            path = os.path.join(CHECKPOINT_DIR, name)
+            try:
+                if os.stat(path).st_mtime < cutoff:
+                    os.remove(path)
+                    removed += 1
+            except OSError:
+                continue
+    return removed
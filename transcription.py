@@ -1,32 +1,329 @@
 import os
 import wave
-from google.cloud import speech
-from google.cloud.speech_v1 import types
+import queue
+import hashlib
+import random
+import subprocess
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from google.api_core import exceptions as gcp_exceptions
 from dotenv import load_dotenv
 
+import audio_utils
+import speech_backends
+import transcript_cache
+from job_scheduler import JobCancelled
+
 # Load environment variables
 load_dotenv()
 
-# Initialize Google Cloud credentials
-credentials_path = os.getenv('GOOGLE_APPLICATION_CREDENTIALS', 'gcp-credentials.json')
-if os.path.exists(credentials_path):
-    os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = credentials_path
-else:
-    print(f"Warning: Google Cloud credentials file not found at {credentials_path}")
+# Recognition language for all requests
+LANGUAGE_CODE = os.getenv("SPEECH_LANGUAGE_CODE", "ta-IN")
+
+# Encoding used for chunk uploads (LINEAR16, FLAC or OGG_OPUS) and optional 8kHz telephony profile
+UPLOAD_ENCODING = os.getenv("SPEECH_UPLOAD_ENCODING", "LINEAR16").upper()
+if UPLOAD_ENCODING not in audio_utils.UPLOAD_ENCODINGS:
+    print(f"Warning: unsupported SPEECH_UPLOAD_ENCODING {UPLOAD_ENCODING}, using LINEAR16")
+    UPLOAD_ENCODING = "LINEAR16"
+TELEPHONY_PROFILE = os.getenv("SPEECH_TELEPHONY_PROFILE", "0") == "1"
+
+# Max number of chunks sent to the Speech API at the same time
+TRANSCRIBE_CONCURRENCY = int(os.getenv("TRANSCRIBE_CONCURRENCY", "4"))
+
+# Cut chunks at pauses and drop long silences instead of fixed 50s slices
+SILENCE_SPLIT = os.getenv("SILENCE_SPLIT", "1") == "1"
+
+# Per-chunk retries for transient errors (exponential backoff with full jitter)
+CHUNK_MAX_RETRIES = int(os.getenv("CHUNK_MAX_RETRIES", "4"))
+CHUNK_RETRY_BASE_DELAY = float(os.getenv("CHUNK_RETRY_BASE_DELAY", "1.0"))
+CHUNK_RETRY_MAX_DELAY = float(os.getenv("CHUNK_RETRY_MAX_DELAY", "30.0"))
+RETRYABLE_CHUNK_ERRORS = (
+    gcp_exceptions.ServiceUnavailable,
+    gcp_exceptions.DeadlineExceeded,
+    gcp_exceptions.InternalServerError,
+    gcp_exceptions.ResourceExhausted,
+    gcp_exceptions.Aborted,
+    ConnectionError,
+    TimeoutError,
+)
 
-def transcribe_audio_direct(file_path, progress_callback=None):
+
+def _recognize_chunk(backend, frames, sample_rate, channels):
+    """
+    Sends one PCM chunk to the sync recognizer and returns its transcript parts.
+    The chunk is re-encoded per UPLOAD_ENCODING / TELEPHONY_PROFILE before upload.
+    """
+    content, encoding, sample_rate, channels = audio_utils.encode_chunk(
+        frames, sample_rate, channels, UPLOAD_ENCODING, TELEPHONY_PROFILE
+    )
+    return backend.recognize(content, encoding, sample_rate, channels, LANGUAGE_CODE)
+
+
+def _recognize_with_retry(backend, frames, sample_rate, channels, chunk_label=""):
+    """Calls _recognize_chunk, retrying transient failures with exponential backoff and jitter."""
+    for attempt in range(CHUNK_MAX_RETRIES + 1):
+        try:
+            return _recognize_chunk(backend, frames, sample_rate, channels)
+        except RETRYABLE_CHUNK_ERRORS as e:
+            if attempt == CHUNK_MAX_RETRIES:
+                raise
+            delay = random.uniform(0, min(CHUNK_RETRY_MAX_DELAY, CHUNK_RETRY_BASE_DELAY * 2 ** attempt))
+            print(f"Chunk {chunk_label} attempt {attempt + 1} failed ({e}); retrying in {delay:.1f}s")
+            time.sleep(delay)
+
+
+def transcribe_chunks(backend, chunks, sample_rate, channels, progress_callback=None, max_workers=None,
+                      failed_chunks=None, checkpoint_key=None, on_chunk=None, cancel_event=None):
+    """
+    Transcribes PCM chunks concurrently and joins the results in order.
+
+    Args:
+        backend: SpeechBackend used for every chunk
+        chunks: List or iterator of raw LINEAR16 frame buffers. Iterators are consumed
+            lazily, so chunks are sent while later audio is still being produced.
+        sample_rate: Sample rate of the frames
+        channels: Channel count of the frames
+        progress_callback: Optional callable receiving status messages
+        max_workers: Concurrency limit (defaults to TRANSCRIBE_CONCURRENCY)
+        failed_chunks: Optional list that receives the indexes of chunks that errored
+        checkpoint_key: Optional key under which completed chunks are checkpointed;
+            chunks already in the checkpoint are not sent again
+        on_chunk: Optional callable(idx, parts) invoked as each chunk completes (in completion order)
+        cancel_event: Optional threading.Event; once set, no further chunks are sent and
+            JobCancelled is raised (chunks already at the Speech API are still checkpointed)
+
+    Returns:
+        str: Transcript of all chunks in their original order
+    """
+    if max_workers is None:
+        max_workers = TRANSCRIBE_CONCURRENCY
+    total_chunks = len(chunks) if hasattr(chunks, "__len__") else None
+    max_workers = max(1, min(max_workers, total_chunks or max_workers))
+
+    results = {}
+    if checkpoint_key:
+        transcript_cache.purge_checkpoints()
+        results.update(transcript_cache.load_checkpoint(checkpoint_key))
+        if results:
+            print(f"Resuming transcription: {len(results)} chunks already checkpointed")
+            if on_chunk:
+                for idx in sorted(results):
+                    on_chunk(idx, results[idx])
+    state = {"done": len(results), "submitted": len(results)}
+    lock = threading.Lock()
+    # Caps chunks held in memory when the producer is faster than the recognizer
+    in_flight = threading.BoundedSemaphore(max_workers * 2)
+
+    def recognize(frames, idx):
+        # Chunks still queued when the job is cancelled never reach the Speech API
+        if cancel_event is not None and cancel_event.is_set():
+            raise JobCancelled("Transcription cancelled")
+        return _recognize_with_retry(backend, frames, sample_rate, channels, str(idx + 1))
+
+    def on_done(future, idx):
+        in_flight.release()
+        try:
+            parts = future.result()
+        except JobCancelled:
+            return
+        except Exception as e:
+            print(f"Chunk {idx + 1} transcription error: {e}")
+            if failed_chunks is not None:
+                failed_chunks.append(idx)
+            parts = None
+        if parts is not None and checkpoint_key:
+            transcript_cache.save_checkpoint_chunk(checkpoint_key, idx, parts)
+        if parts is not None and on_chunk:
+            on_chunk(idx, parts)
+        with lock:
+            results[idx] = parts or []
+            state["done"] += 1
+            done = state["done"]
+            total = total_chunks or state["submitted"]
+        if progress_callback:
+            progress_callback(f"Transcribed chunk {done}/{total}...")
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for idx, frames in enumerate(chunks):
+            if cancel_event is not None and cancel_event.is_set():
+                break
+            if idx in results:
+                continue
+            in_flight.acquire()
+            with lock:
+                state["submitted"] += 1
+            future = executor.submit(recognize, frames, idx)
+            future.add_done_callback(lambda f, idx=idx: on_done(f, idx))
+
+    if cancel_event is not None and cancel_event.is_set():
+        raise JobCancelled("Transcription cancelled")
+
+    return " ".join(part for idx in sorted(results) for part in results[idx]).strip()
+
+
+def transcribe_stream(input_path, progress_callback=None, max_workers=None, backend=None, on_chunk=None,
+                      source_hash=None, cancel_event=None):
+    """
+    Decodes any audio file with FFmpeg and transcribes it as the PCM arrives.
+
+    FFmpeg's stdout is cut into chunks on the fly, so early chunks are already at the
+    Speech API while later audio is still decoding, and no intermediate WAV is written.
+
+    Args:
+        source_hash: SHA-256 of input_path if already known (hashed during upload)
+        cancel_event: Optional threading.Event that stops transcription and kills FFmpeg
+    """
+    print(f"Streaming audio file: {input_path}")
+    if progress_callback:
+        progress_callback("Decoding and transcribing audio...")
+
+    backend = backend or speech_backends.get_backend()
+    source_hash = source_hash or transcript_cache.file_sha256(input_path)
+    source_key = transcript_cache.make_key("src:" + source_hash, LANGUAGE_CODE, backend.name)
+    checkpoint_key = transcript_cache.make_key(source_key, "chunks:stream:" + audio_utils.chunking_signature())
+    if transcript_cache.CACHE_ENABLED:
+        cached = transcript_cache.get(source_key)
+        if cached is not None:
+            print("Transcript cache hit.")
+            if progress_callback:
+                progress_callback("Transcript found in cache.")
+            return cached
+
+    sample_rate = audio_utils.TARGET_SAMPLE_RATE
+    command = audio_utils.ffmpeg_pcm_command(input_path, "pipe:1", raw=True)
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    pcm_hash = hashlib.sha256(f"{sample_rate}:1:2".encode())
+
+    def pcm_blocks():
+        while True:
+            block = process.stdout.read(sample_rate * 2)  # ~1s of mono 16-bit audio
+            if not block:
+                break
+            pcm_hash.update(block)
+            yield block
+
+    failed_chunks = []
+    try:
+        chunks = audio_utils.iter_pcm_chunks(pcm_blocks(), sample_rate, channels=1)
+        transcript = transcribe_chunks(backend, chunks, sample_rate, 1, progress_callback, max_workers,
+                                       failed_chunks, checkpoint_key, on_chunk, cancel_event)
+    except BaseException:
+        process.kill()
+        raise
+    finally:
+        process.stdout.close()
+        returncode = process.wait()
+
+    if returncode != 0:
+        raise Exception(f"FFmpeg decoding failed (exit code {returncode})")
+
+    _raise_for_failed_chunks(failed_chunks)
+    transcript_cache.clear_checkpoint(checkpoint_key)
+
+    if transcript_cache.CACHE_ENABLED and transcript:
+        transcript_cache.put(source_key, transcript, LANGUAGE_CODE)
+        transcript_cache.put(transcript_cache.make_key(pcm_hash.hexdigest(), LANGUAGE_CODE, backend.name), transcript, LANGUAGE_CODE)
+    return transcript
+
+
+def iter_transcribe(file_path, progress_callback=None, max_workers=None, backend=None, stream=False, source_hash=None,
+                    cancel_event=None):
+    """
+    Generator version of transcription: yields (chunk_index, text) as chunks complete.
+
+    Chunks arrive in completion order, so consumers should reassemble by index. Paths that do
+    not chunk (short audio, MP3, cache hits) yield the whole transcript once as chunk 0.
+    Transcription runs in a background thread; errors are re-raised in the consumer.
+
+    Args:
+        stream: Decode with FFmpeg on the fly (transcribe_stream) instead of reading a WAV
+        source_hash: SHA-256 of file_path if already known; saves rehashing it when streaming
+        cancel_event: Optional threading.Event; setting it stops between chunks with JobCancelled
+    """
+    events = queue.Queue()
+    finished = object()
+
+    def on_chunk(idx, parts):
+        events.put((idx, " ".join(parts).strip()))
+
+    def worker():
+        try:
+            if stream:
+                transcript = transcribe_stream(file_path, progress_callback, max_workers, backend, on_chunk,
+                                               source_hash, cancel_event)
+            else:
+                transcript = transcribe_audio_direct(file_path, progress_callback, max_workers, backend, on_chunk,
+                                                     cancel_event)
+            events.put((finished, transcript))
+        except Exception as e:
+            events.put((finished, e))
+
+    threading.Thread(target=worker, daemon=True).start()
+
+    yielded = False
+    while True:
+        idx, item = events.get()
+        if idx is finished:
+            if isinstance(item, Exception):
+                raise item
+            if not yielded and item:
+                yield 0, item
+            return
+        yielded = True
+        yield idx, item
+
+
+def transcribe_audio_direct(file_path, progress_callback=None, max_workers=None, backend=None, on_chunk=None,
+                            cancel_event=None):
     """
     Transcribes an audio file. 
-    - If WAV and > 10MB, splits into chunks.
+    - If WAV and > 10MB, splits into chunks (transcribed concurrently, see max_workers).
     - If MP3, uses MP3 encoding.
     - Otherwise tries direct send (limit 10MB).
+    Recognition goes through `backend` (defaults to the one selected by SPEECH_BACKEND).
+    `on_chunk(idx, parts)` is called as each chunk of a large WAV completes.
+    Setting `cancel_event` stops chunked transcription with JobCancelled.
     """
     print(f"Processing audio file: {file_path}")
     if progress_callback:
         progress_callback("Initializing transcription service...")
         
-    client = speech.SpeechClient()
-    
+    backend = backend or speech_backends.get_backend()
+    cache_key = transcript_cache.make_key(transcript_cache.audio_fingerprint(file_path), LANGUAGE_CODE, backend.name)
+    # Chunk indexes depend on how chunks are cut, so the chunking settings are part of the checkpoint key
+    checkpoint_key = transcript_cache.make_key(cache_key, "chunks:" + audio_utils.chunking_signature(SILENCE_SPLIT))
+    if transcript_cache.CACHE_ENABLED:
+        cached = transcript_cache.get(cache_key)
+        if cached is not None:
+            print("Transcript cache hit.")
+            if progress_callback:
+                progress_callback("Transcript found in cache.")
+            return cached
+
+    failed_chunks = []
+    transcript = _transcribe_with_backend(backend, file_path, progress_callback, max_workers, failed_chunks,
+                                          checkpoint_key, on_chunk, cancel_event)
+
+    # Never return (or cache) a transcript with holes in it
+    _raise_for_failed_chunks(failed_chunks)
+    transcript_cache.clear_checkpoint(checkpoint_key)
+
+    if transcript_cache.CACHE_ENABLED and transcript:
+        transcript_cache.put(cache_key, transcript, LANGUAGE_CODE)
+    return transcript
+
+
+def _raise_for_failed_chunks(failed_chunks):
+    if failed_chunks:
+        raise Exception(
+            f"{len(failed_chunks)} chunk(s) failed after {CHUNK_MAX_RETRIES} retries. "
+            "Completed chunks are checkpointed and will not be re-sent when the file is retried."
+        )
+
+
+def _transcribe_with_backend(backend, file_path, progress_callback=None, max_workers=None, failed_chunks=None,
+                             checkpoint_key=None, on_chunk=None, cancel_event=None):
     # Check for MP3
     if file_path.lower().endswith(".mp3"):
         print("Detected MP3 file. Using MP3 encoding...")
@@ -36,25 +333,12 @@ def transcribe_audio_direct(file_path, progress_callback=None):
         with open(file_path, "rb") as audio_file:
             content = audio_file.read()
             
-        audio = types.RecognitionAudio(content=content)
-        config = types.RecognitionConfig(
-            encoding=types.RecognitionConfig.AudioEncoding.MP3,
-            language_code="ta-IN"
-        )
-        
         # Use long_running for potentially large MP3s
         print("Starting MP3 transcription...")
-        operation = client.long_running_recognize(config=config, audio=audio)
-        
         if progress_callback:
             progress_callback("Processing MP3 audio (this may take a while)...")
             
-        response = operation.result()
-        
-        transcript = ""
-        for result in response.results:
-            transcript += result.alternatives[0].transcript + " "
-        return transcript.strip()
+        return " ".join(backend.recognize_long(content, "MP3", LANGUAGE_CODE)).strip()
 
     # Try processing as WAV first
     try:
@@ -75,15 +359,7 @@ def transcribe_audio_direct(file_path, progress_callback=None):
                     
                 wf.rewind()
                 frames = wf.readframes(total_frames)
-                audio = types.RecognitionAudio(content=frames)
-                config = types.RecognitionConfig(
-                    encoding=types.RecognitionConfig.AudioEncoding.LINEAR16,
-                    sample_rate_hertz=sample_rate,
-                    language_code="ta-IN",
-                    audio_channel_count=channels
-                )
-                response = client.recognize(config=config, audio=audio)
-                transcript = " ".join([result.alternatives[0].transcript for result in response.results])
+                transcript = " ".join(_recognize_with_retry(backend, frames, sample_rate, channels, "1"))
                 return transcript.strip()
             
             # If large, chunk it
@@ -91,45 +367,27 @@ def transcribe_audio_direct(file_path, progress_callback=None):
             if progress_callback:
                 progress_callback(f"Large file detected ({duration:.0f}s). Splitting into chunks...")
             
-            chunk_duration = 50 # seconds
-            frames_per_chunk = int(sample_rate * chunk_duration)
-            full_transcript = []
+            wf.rewind()
+            chunks = []
+            if SILENCE_SPLIT and wf.getsampwidth() == 2:
+                chunks = audio_utils.split_on_silence(wf.readframes(total_frames), sample_rate, channels)
+            else:
+                chunk_duration = 50 # seconds
+                frames_per_chunk = int(sample_rate * chunk_duration)
+                while True:
+                    frames = wf.readframes(frames_per_chunk)
+                    if not frames:
+                        break
+                    chunks.append(frames)
             
-            total_chunks = int(total_frames / frames_per_chunk) + 1
+            if progress_callback:
+                progress_callback(f"Transcribing {len(chunks)} chunks...")
             
-            wf.rewind()
-            chunk_idx = 0
-            while True:
-                frames = wf.readframes(frames_per_chunk)
-                if not frames:
-                    break
-                
-                # Check if chunk is empty
-                if len(frames) == 0:
-                    break
-                
-                chunk_idx += 1
-                if progress_callback:
-                    progress_callback(f"Transcribing chunk {chunk_idx}/{total_chunks}...")
-
-                audio = types.RecognitionAudio(content=frames)
-                config = types.RecognitionConfig(
-                    encoding=types.RecognitionConfig.AudioEncoding.LINEAR16,
-                    sample_rate_hertz=sample_rate,
-                    language_code="ta-IN",
-                    audio_channel_count=channels
-                )
-                
-                try:
-                    print("Transcribing chunk...")
-                    response = client.recognize(config=config, audio=audio)
-                    for result in response.results:
-                        full_transcript.append(result.alternatives[0].transcript)
-                except Exception as e:
-                    print(f"Chunk transcription error: {e}")
-                    
-            return " ".join(full_transcript).strip()
+            return transcribe_chunks(backend, chunks, sample_rate, channels, progress_callback, max_workers,
+                                     failed_chunks, checkpoint_key, on_chunk, cancel_event)
 
+    except JobCancelled:
+        raise
     except wave.Error:
         print("Not a valid WAV file or header issue. Falling back to raw read...")
     except Exception as e:
@@ -142,21 +400,8 @@ def transcribe_audio_direct(file_path, progress_callback=None):
     if len(content) > 10 * 1024 * 1024:
         raise Exception("File too large (>10MB) and not a valid WAV for chunking. Please convert to WAV or use a smaller file.")
 
-    audio = types.RecognitionAudio(content=content)
-    config = types.RecognitionConfig(
-        encoding=types.RecognitionConfig.AudioEncoding.LINEAR16, 
-        language_code="ta-IN", 
-    )
-
     print("Starting transcription (direct fallback)...")
     if progress_callback:
         progress_callback("Starting fallback transcription...")
         
-    operation = client.long_running_recognize(config=config, audio=audio)
-    response = operation.result()
-    
-    transcript = ""
-    for result in response.results:
-        transcript += result.alternatives[0].transcript + " "
-        
-    return transcript.strip()
+    return " ".join(backend.recognize_long(content, "LINEAR16", LANGUAGE_CODE)).strip()
@@ -0,0 +1,290 @@
+import os
+import re
+import sqlite3
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from deep_translator import GoogleTranslator
+from dotenv import load_dotenv
+
+import job_scheduler
+
+# Load environment variables
+load_dotenv()
+
+# GoogleTranslator rejects requests over 5000 characters
+TRANSLATE_MAX_CHARS = int(os.getenv("TRANSLATE_MAX_CHARS", "4500"))
+TRANSLATE_CONCURRENCY = int(os.getenv("TRANSLATE_CONCURRENCY", "4"))
+# Translation overlaps transcription (StreamingTranslator), outside the "translate" stage limit,
+# so requests in flight are capped process-wide at what that stage would allow
+TRANSLATE_MAX_REQUESTS = max(1, job_scheduler.STAGE_WORKERS["translate"] * TRANSLATE_CONCURRENCY)
+
+# Sentence-level translation cache (in-memory LRU in front of SQLite)
+TRANSLATION_CACHE_DB = os.getenv("TRANSLATION_CACHE_DB", os.path.join("cache", "translations.db"))
+TRANSLATION_MEMORY_CACHE_SIZE = int(os.getenv("TRANSLATION_MEMORY_CACHE_SIZE", "10000"))
+# Least recently used sentences beyond this count are evicted from SQLite
+TRANSLATION_CACHE_MAX_ENTRIES = int(os.getenv("TRANSLATION_CACHE_MAX_ENTRIES", "200000"))
+
+# Sentence ends (Latin and Devanagari danda) followed by whitespace
+SENTENCE_END = re.compile(r"(?<=[.!?।])\s+")
+SEPARATOR = "\n"
+
+_memory_cache = OrderedDict()
+_memory_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0, "evictions": 0}
+_request_slots = threading.BoundedSemaphore(TRANSLATE_MAX_REQUESTS)
+
+
+def init_cache_db():
+    os.makedirs(os.path.dirname(TRANSLATION_CACHE_DB) or ".", exist_ok=True)
+    conn = sqlite3.connect(TRANSLATION_CACHE_DB)
+    c = conn.cursor()
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS translations (
+            key TEXT PRIMARY KEY,
+            source_text TEXT,
+            translated_text TEXT
+        )
+    ''')
+    # Caches created before eviction existed have no last_used column; their rows are evicted first
+    columns = [row[1] for row in c.execute("PRAGMA table_info(translations)")]
+    if "last_used" not in columns:
+        c.execute("ALTER TABLE translations ADD COLUMN last_used REAL")
+    c.execute("CREATE INDEX IF NOT EXISTS translations_last_used ON translations (last_used)")
+    conn.commit()
+    conn.close()
+
+
+def _key(sentence, source, target):
+    return hashlib.sha256(f"{source}:{target}:{sentence}".encode("utf-8")).hexdigest()
+
+
+def _remember(key, translated):
+    with _memory_lock:
+        _memory_cache[key] = translated
+        _memory_cache.move_to_end(key)
+        while len(_memory_cache) > TRANSLATION_MEMORY_CACHE_SIZE:
+            _memory_cache.popitem(last=False)
+
+
+def _cache_lookup(keys):
+    """
+    Returns {key: translation} for every key found in memory or SQLite.
+    The SQLite cache is best-effort: if it cannot be read, the sentences are simply translated again.
+    """
+    found = {}
+    missing = []
+    with _memory_lock:
+        for key in keys:
+            if key in _memory_cache:
+                _memory_cache.move_to_end(key)
+                found[key] = _memory_cache[key]
+            else:
+                missing.append(key)
+
+    if missing:
+        try:
+            conn = sqlite3.connect(TRANSLATION_CACHE_DB)
+            try:
+                c = conn.cursor()
+                hits = []
+                for start in range(0, len(missing), 500):
+                    batch = missing[start:start + 500]
+                    c.execute(
+                        f"SELECT key, translated_text FROM translations WHERE key IN ({','.join('?' * len(batch))})",
+                        batch,
+                    )
+                    for key, translated in c.fetchall():
+                        found[key] = translated
+                        hits.append(key)
+                        _remember(key, translated)
+                if hits:
+                    now = time.time()
+                    c.executemany("UPDATE translations SET last_used=? WHERE key=?", [(now, key) for key in hits])
+                    conn.commit()
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            print(f"[WARNING] Translation cache lookup failed: {e}")
+    return found
+
+
+def _cache_store(entries):
+    """
+    Stores [(key, source_text, translated_text)] and evicts the least recently used
+    sentences above TRANSLATION_CACHE_MAX_ENTRIES. Failed writes are logged, not raised.
+    """
+    if not entries:
+        return
+    for key, _, translated in entries:
+        _remember(key, translated)
+    now = time.time()
+    try:
+        conn = sqlite3.connect(TRANSLATION_CACHE_DB)
+        try:
+            c = conn.cursor()
+            c.executemany(
+                "INSERT OR REPLACE INTO translations (key, source_text, translated_text, last_used) VALUES (?, ?, ?, ?)",
+                [(key, source_text, translated, now) for key, source_text, translated in entries],
+            )
+            c.execute('''
+                DELETE FROM translations WHERE key IN (
+                    SELECT key FROM translations ORDER BY last_used DESC LIMIT -1 OFFSET ?
+                )
+            ''', (TRANSLATION_CACHE_MAX_ENTRIES,))
+            evicted = c.rowcount
+            conn.commit()
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        print(f"[WARNING] Translation cache write failed: {e}")
+        return
+    if evicted > 0:
+        with _memory_lock:
+            _stats["evictions"] += evicted
+
+
+def split_sentences(text, max_chars=TRANSLATE_MAX_CHARS):
+    """
+    Splits text into normalized sentences no longer than max_chars.
+    Speech transcripts are often unpunctuated, so over-long sentences are split on word boundaries.
+    """
+    sentences = []
+    for sentence in SENTENCE_END.split(text):
+        sentence = " ".join(sentence.split())
+        while len(sentence) > max_chars:
+            cut = sentence.rfind(" ", 0, max_chars)
+            if cut <= 0:
+                cut = max_chars
+            sentences.append(sentence[:cut].strip())
+            sentence = sentence[cut:].strip()
+        if sentence:
+            sentences.append(sentence)
+    return sentences
+
+
+def make_batches(sentences, max_chars=TRANSLATE_MAX_CHARS):
+    """Groups sentences into batches whose joined length stays within max_chars."""
+    batches = []
+    current = []
+    current_len = 0
+    for sentence in sentences:
+        added = len(sentence) + (len(SEPARATOR) if current else 0)
+        if current and current_len + added > max_chars:
+            batches.append(current)
+            current, current_len = [], 0
+            added = len(sentence)
+        current.append(sentence)
+        current_len += added
+    if current:
+        batches.append(current)
+    return batches
+
+
+def _translate_batch(batch, source, target):
+    """Translates a batch of sentences in one request, returning one translation per sentence."""
+    translator = GoogleTranslator(source=source, target=target)
+    with _request_slots:
+        translated = translator.translate(SEPARATOR.join(batch)) or ""
+        parts = [part.strip() for part in translated.split(SEPARATOR)]
+        if len(parts) == len(batch):
+            return parts
+        # The service merged or split lines; fall back to one request per sentence
+        print(f"Translation batch returned {len(parts)} lines for {len(batch)} sentences, translating individually")
+        return [(translator.translate(sentence) or "").strip() for sentence in batch]
+
+
+def translate_text(text, source="auto", target="en", progress_callback=None, max_workers=None):
+    """
+    Translates arbitrarily long text.
+    Splits on sentence boundaries into request-sized batches, translates the batches concurrently
+    and serves repeated sentences from the cache.
+    """
+    if not text or not text.strip():
+        return ""
+    if max_workers is None:
+        max_workers = TRANSLATE_CONCURRENCY
+
+    sentences = split_sentences(text)
+    keys = [_key(sentence, source, target) for sentence in sentences]
+    translations = _cache_lookup(set(keys))
+
+    pending = []
+    seen = set()
+    for sentence, key in zip(sentences, keys):
+        if key not in translations and key not in seen:
+            seen.add(key)
+            pending.append(sentence)
+
+    with _memory_lock:
+        _stats["hits"] += len(sentences) - len(pending)
+        _stats["misses"] += len(pending)
+
+    if pending:
+        batches = make_batches(pending)
+        print(f"Translating {len(pending)}/{len(sentences)} uncached sentences in {len(batches)} batches...")
+        if progress_callback:
+            progress_callback(f"Translating {len(batches)} batches...")
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(batches)))) as executor:
+            results = list(executor.map(lambda batch: _translate_batch(batch, source, target), batches))
+
+        new_entries = []
+        for batch, translated in zip(batches, results):
+            for sentence, result in zip(batch, translated):
+                key = _key(sentence, source, target)
+                translations[key] = result
+                new_entries.append((key, sentence, result))
+        _cache_store(new_entries)
+
+    return " ".join(translations[key] for key in keys if translations[key]).strip()
+
+
+class StreamingTranslator:
+    """
+    Translates transcript chunks while transcription is still running.
+    Each submitted chunk is translated in the background; result() reassembles them in index order.
+    """
+
+    def __init__(self, source="auto", target="en", max_workers=None):
+        self.source = source
+        self.target = target
+        self._executor = ThreadPoolExecutor(max_workers=max_workers or TRANSLATE_CONCURRENCY)
+        self._sources = {}
+        self._futures = {}
+
+    def submit(self, idx, text):
+        self._sources[idx] = text
+        # A chunk may be the whole transcript (cache hits, MP3, short audio), so its batches run in parallel too;
+        # _request_slots keeps the total number of requests bounded
+        self._futures[idx] = self._executor.submit(translate_text, text, self.source, self.target)
+
+    def source_text(self):
+        """The untranslated text of all submitted chunks, in order."""
+        return " ".join(self._sources[idx] for idx in sorted(self._sources) if self._sources[idx]).strip()
+
+    def result(self):
+        """Waits for every submitted chunk and returns the joined translation."""
+        try:
+            translated = [self._futures[idx].result() for idx in sorted(self._futures)]
+        finally:
+            self.close()
+        return " ".join(text for text in translated if text).strip()
+
+    def close(self):
+        """Stops the worker threads, dropping chunks that have not started yet."""
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def stats():
+    """Sentence-level hit/miss counters of the translation cache."""
+    with _memory_lock:
+        result = dict(_stats)
+        result["memory_entries"] = len(_memory_cache)
+    lookups = result["hits"] + result["misses"]
+    result["hit_rate"] = round(result["hits"] / lookups, 3) if lookups else 0.0
+    return result
+
+
+init_cache_db()